@@ -1,10 +1,25 @@
+import time
+_script_start = time.perf_counter()
+
 import streamlit as st
-import pandas as pd
+import importlib
+import sys
 import random
 import json
 import os
 import io
 import base64
+import uuid
+from plan_store import PlanRegistry, project_types, search_projects, site_fingerprints
+from change_feed import watch_plan_files
+from planning import partition_by_site, calculate_sites, merge_results
+from sites import DEFAULT_SITE, get_site
+from timeline import aggregate_timeline
+from load_balancer import DEFAULT_CAPACITY_HOURS
+
+# pandas (and openpyxl through it), plotly and the process pool are only
+# imported when Export, Import or Berechnen need them, see lazy_import()
+_imports_done = time.perf_counter()
 
 # Page configuration
 st.set_page_config(
@@ -13,6 +28,19 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# Function to collect startup timings, shared by all sessions of the process
+@st.cache_resource
+def get_startup_timings():
+    return {"Module importieren": _imports_done - _script_start}
+
+# Function to import a heavy module on first use and record how long it took
+def lazy_import(name):
+    if name not in sys.modules:
+        start = time.perf_counter()
+        importlib.import_module(name)
+        get_startup_timings()[f"Import {name}"] = time.perf_counter() - start
+    return sys.modules[name]
+
 # Increase sidebar width
 st.markdown("""
 <style>
@@ -25,24 +53,35 @@ st.markdown("""
 
 # Define path for storing project data
 DATA_FILE = "project_data.json"
+SNAPSHOT_FILE = "project_data.snap"
+EMPLOYEE_FILE = "employee_data.json"
+
+# Number of projects shown per sidebar page
+PROJECTS_PER_PAGE = 50
+
+# Project types of the naming scheme "<Typ>-Projekt 1234"
+PROJECT_TYPES = ["Hardware", "Software", "Netzwerk", "Cloud", "KI", "Datenbank", "Security", "Mobile", "Web", "IoT"]
 
 # Function to generate random projects
 def generate_random_projects(num_projects=5):
-    project_types = ["Hardware", "Software", "Netzwerk", "Cloud", "KI", "Datenbank", "Security", "Mobile", "Web", "IoT"]
     projects = []
     
     for i in range(num_projects):
         # Random project name
-        project_type = random.choice(project_types)
+        project_type = random.choice(PROJECT_TYPES)
         project_name = f"{project_type}-Projekt {random.randint(1000, 9999)}"
         
         # Random quantity
         quantity = random.randint(1, 50)
+
+        # Random production hall
+        site = random.choice([DEFAULT_SITE, "Halle 2"])
         
         # Create project
         project = {
             "name": project_name,
             "quantity": quantity,
+            "site": site,
             "stations": {
                 "Station 1": random.choice([True, False]),
                 "Station 2": random.choice([True, False]),
@@ -58,10 +97,24 @@ def generate_random_projects(num_projects=5):
     return projects
 
 # Function to save projects to file
+#
+# Publishes the uncommitted projects and employees of this session as a new
+# base plan. Records another planner changed in the meantime are not
+# written but flagged as conflicts for the user to resolve. The session then
+# moves onto the new version right away: edits in dialogs only rerun the
+# dialog, and a further edit on the old base would look like a conflict with
+# the session's own commit.
 def save_projects():
     try:
-        with open(DATA_FILE, "w") as f:
-            json.dump(st.session_state.projects, f)
+        base, conflicts = get_plan_registry().commit(
+            st.session_state.projects,
+            st.session_state.employee_data['employees'],
+            author=st.session_state.session_token,
+            skip=st.session_state.plan_conflicts
+        )
+        for kind, record_ids in conflicts.items():
+            st.session_state.plan_conflicts[kind] |= record_ids
+        sync_plan_session()
     except Exception as e:
         st.error(f"Fehler beim Speichern der Projekte: {e}")
 
@@ -77,11 +130,87 @@ def load_projects():
         st.error(f"Fehler beim Laden der Projekte: {e}")
         return generate_random_projects()
 
+# Function to get the plan shared by all sessions, loaded once per process
+@st.cache_resource
+def get_plan_registry():
+    start = time.perf_counter()
+    registry = PlanRegistry(SNAPSHOT_FILE, EMPLOYEE_FILE)
+    if registry.base is None:
+        # First start: convert the old JSON file or generate random projects
+        initial_projects = load_projects()
+        if not initial_projects or len(initial_projects) == 0:
+            initial_projects = generate_random_projects()
+        registry.replace(initial_projects, [{'id': 1, 'site': DEFAULT_SITE, 'stations': {}}])
+    get_startup_timings()["Plan laden"] = time.perf_counter() - start
+    return registry
+
+# Function to start the change feed for the plan files, once per process
+@st.cache_resource
+def get_plan_watcher():
+    return watch_plan_files(get_plan_registry())
+
+# Function to give the session fresh overlays on the current base plan
+def open_plan_session():
+    registry = get_plan_registry()
+    projects, employees = registry.open_session()
+    st.session_state.projects = projects
+    st.session_state.employee_data = {'employees': employees}
+    st.session_state.plan_version = registry.base.version
+    st.session_state.plan_conflicts = {"projects": set(), "employees": set()}
+    if 'session_token' not in st.session_state:
+        st.session_state.session_token = uuid.uuid4().hex
+
+# Function to check for new plan versions, polls the files if the change feed is not running
+def get_latest_plan_version():
+    registry = get_plan_registry()
+    if get_plan_watcher() is None:
+        registry.reload_if_changed()
+    return registry.base.version
+
+# Function to move the session onto the latest base plan
+#
+# The search index belongs to the base plan, so there is nothing to update
+# here. Local edits of records that were changed by another planner at the
+# same time are kept and flagged as conflicts.
+def sync_plan_session():
+    if get_latest_plan_version() == st.session_state.plan_version:
+        return
+    registry = get_plan_registry()
+    base = registry.base
+    changes = registry.changes_since(st.session_state.plan_version, st.session_state.session_token)
+    old_ids = st.session_state.projects.ids()
+    selected_index = st.session_state.selected_project_index
+    selected_id = old_ids[selected_index] if selected_index is not None and selected_index < len(old_ids) else None
+
+    project_conflicts, dropped_projects = st.session_state.projects.rebase(base.projects)
+    employee_conflicts, dropped_employees = st.session_state.employee_data['employees'].rebase(base.employees)
+    st.session_state.plan_version = base.version
+    st.session_state.plan_conflicts["projects"] = (st.session_state.plan_conflicts["projects"] | project_conflicts) - dropped_projects
+    st.session_state.plan_conflicts["employees"] = (st.session_state.plan_conflicts["employees"] | employee_conflicts) - dropped_employees
+
+    # Keep the selected project selected, other planners may have moved it in the list
+    new_ids = st.session_state.projects.ids()
+    if selected_id in new_ids:
+        st.session_state.selected_project_index = new_ids.index(selected_id)
+    elif selected_index is not None:
+        st.session_state.selected_project_index = 0 if new_ids else None
+        # The settings dialog must not reopen on another project
+        st.session_state.show_settings_dialog = False
+
+    if changes is None:
+        st.toast("Der Plan wurde von einem anderen Planer neu geladen.", icon="🔄")
+    elif changes["foreign"]:
+        st.toast(f"{changes['foreign']} Änderungen anderer Planer übernommen.", icon="🔄")
+    if dropped_projects or dropped_employees:
+        st.toast(f"{len(dropped_projects) + len(dropped_employees)} von Ihnen geänderte Einträge wurden von einem anderen Planer gelöscht.", icon="⚠️")
+
 # Function to export projects to Excel
 def export_to_excel():
+    pd = lazy_import("pandas")
+
     # Convert projects to DataFrames
     projects_df = pd.DataFrame([
-        {"name": p["name"], "quantity": p["quantity"]} 
+        {"name": p["name"], "quantity": p["quantity"], "site": get_site(p)}
         for p in st.session_state.projects
     ])
     
@@ -116,6 +245,8 @@ def get_excel_download_link(excel_file, file_name="projekte.xlsx"):
 
 # Function to import projects from Excel
 def import_from_excel(file):
+    pd = lazy_import("pandas")
+
     try:
         # Check if the file is readable
         if file is None:
@@ -152,9 +283,15 @@ def import_from_excel(file):
                 except:
                     quantity = 1  # Default to 1 if conversion fails
                 
+                # Use the site column if the file has one
+                site = DEFAULT_SITE
+                if "site" in projects_df.columns and not pd.isna(row["site"]):
+                    site = str(row["site"])
+
                 project = {
                     "name": str(row["name"]),
                     "quantity": quantity,
+                    "site": site,
                     "stations": {
                         "Station 1": False,
                         "Station 2": False,
@@ -192,6 +329,47 @@ def import_from_excel(file):
         raise Exception(f"Fehler beim Importieren der Excel-Datei: {e}")
         return None
 
+# Function to create the timeline chart of the calculated plan
+def create_timeline_chart(site_results, view, window_start, window_end):
+    go = lazy_import("plotly.graph_objects")
+
+    # Collect the tasks of all sites as (lane, label, start, end) in minutes
+    tasks = []
+    for site, result in site_results.items():
+        for station, employee, project_name, start, end in result["tasks"]:
+            if view == "Stationen":
+                tasks.append((f"{site} · {station}", f"{project_name} ({employee})", start, end))
+            else:
+                tasks.append((f"{site} · {employee}", f"{project_name} ({station})", start, end))
+
+    # Aggregate on the server so the browser never gets more than MAX_TIMELINE_POINTS bars
+    timeline = aggregate_timeline(tasks, window_start * 60, window_end * 60)
+    bars = timeline["bars"]
+
+    fig = go.Figure(go.Bar(
+        y=[bar["lane"] for bar in bars],
+        base=[bar["start"] / 60 for bar in bars],
+        x=[(bar["end"] - bar["start"]) / 60 for bar in bars],
+        orientation="h",
+        text=[bar["label"] for bar in bars],
+        hovertemplate="%{y}<br>%{text}<br>%{base:.1f} Std + %{x:.1f} Std<extra></extra>",
+        marker=dict(
+            # Aggregated buckets are coloured by utilisation of the time window
+            color=[bar["busy"] / (bar["end"] - bar["start"]) if bar["end"] > bar["start"] else 1 for bar in bars],
+            colorscale="Blues",
+            cmin=0,
+            cmax=1 if not timeline["aggregated"] else None
+        )
+    ))
+    fig.update_layout(
+        barmode="overlay",
+        xaxis=dict(title="Zeit (Std)", range=[window_start, window_end]),
+        yaxis=dict(autorange="reversed"),
+        height=max(300, 30 * len({bar["lane"] for bar in bars})),
+        margin=dict(l=10, r=10, t=10, b=10)
+    )
+    return fig, timeline
+
 # Initialize all session state variables at the beginning
 # Dialog state management
 if 'show_settings_dialog' not in st.session_state:
@@ -206,13 +384,9 @@ if 'temp_project_settings' not in st.session_state:
 if 'show_results' not in st.session_state:
     st.session_state.show_results = False
 
-# Initialize project list in session state if not exists
+# Initialize project list and employee data in session state if not exists
 if 'projects' not in st.session_state:
-    # Make sure we generate new random projects if no data file exists
-    initial_projects = load_projects()
-    if not initial_projects or len(initial_projects) == 0:
-        initial_projects = generate_random_projects()
-    st.session_state.projects = initial_projects
+    open_plan_session()
     
 # Save projects when app state changes
 def on_change():
@@ -224,13 +398,34 @@ st.session_state.on_change = on_change
 if 'selected_project_index' not in st.session_state:
     st.session_state.selected_project_index = 0 if st.session_state.projects else None
 
-# Initialize employee data if not exists
-if 'employee_data' not in st.session_state:
-    st.session_state.employee_data = {
-        'employees': [
-            {'id': 1, 'stations': {}}
-        ]
-    }
+# Pick up the changes other planners published since the last run
+sync_plan_session()
+
+# Forget the records this session only read. The main script only runs on
+# full reruns; the record an open dialog works on is kept for its fragment reruns.
+held_projects = set()
+if st.session_state.show_settings_dialog and st.session_state.selected_project_index is not None:
+    project_ids = st.session_state.projects.ids()
+    if st.session_state.selected_project_index < len(project_ids):
+        held_projects.add(project_ids[st.session_state.selected_project_index])
+st.session_state.projects.prune(held_projects)
+held_employees = {st.session_state.get("selected_employee_id")} if st.session_state.show_employee_dialog else set()
+st.session_state.employee_data['employees'].prune(held_employees)
+
+# Cached calculation results per site, see planning.calculate_sites
+if 'shard_results' not in st.session_state:
+    st.session_state.shard_results = {}
+
+# Function to get the worker processes shared by all sessions for the per-site calculation
+@st.cache_resource
+def get_executor():
+    futures = lazy_import("concurrent.futures")
+    multiprocessing = lazy_import("multiprocessing")
+    return futures.ProcessPoolExecutor(mp_context=multiprocessing.get_context("spawn"))
+
+# Function to go back to the first page of the project list
+def reset_project_page():
+    st.session_state.project_page = 1
 
 # Sidebar for project management
 with st.sidebar:
@@ -247,7 +442,50 @@ with st.sidebar:
         with titel4:
             st.markdown("Löschen")
 
-        for i, project in enumerate(st.session_state.projects):
+        # Search and filter the project list, a new search starts on the first page
+        search_text = st.text_input("🔍 Suche", key="project_search", placeholder="Projektname", on_change=reset_project_page)
+        col1, col2 = st.columns([1, 1])
+        with col1:
+            index_types = project_types(st.session_state.projects)
+            search_type = st.selectbox(
+                "Projekttyp",
+                options=["Alle"] + sorted(set(PROJECT_TYPES) | set(index_types)),
+                key="project_search_type",
+                on_change=reset_project_page
+            )
+        with col2:
+            search_stations = st.multiselect(
+                "Stationen",
+                options=[f"Station {i}" for i in range(1, 8)],
+                key="project_search_stations",
+                on_change=reset_project_page
+            )
+        
+        if search_text.strip() or search_type != "Alle" or search_stations:
+            visible_indices = search_projects(
+                st.session_state.projects,
+                search_text,
+                type_prefix=None if search_type == "Alle" else search_type,
+                stations=search_stations
+            )
+            st.caption(f"{len(visible_indices)} von {len(st.session_state.projects)} Projekten")
+        else:
+            visible_indices = range(len(st.session_state.projects))
+
+        # Only the rows of the current page are read from the snapshot
+        num_pages = max((len(visible_indices) - 1) // PROJECTS_PER_PAGE + 1, 1)
+        if num_pages > 1:
+            if st.session_state.get("project_page", 1) > num_pages:
+                st.session_state.project_page = num_pages
+            # No value argument, the page is kept in session state only
+            page = st.number_input("Seite", min_value=1, max_value=num_pages, step=1, key="project_page")
+        else:
+            page = 1
+        page_start = (page - 1) * PROJECTS_PER_PAGE
+
+        for i in visible_indices[page_start:page_start + PROJECTS_PER_PAGE]:
+            # Read without copying the project into this session's overlay
+            project = st.session_state.projects.get(i)
             # Präzises Layout mit definierten relativen Breiten
             col1, col2, col3, col4 = st.columns([0.4, 0.2, 0.2, 0.2])
             
@@ -274,7 +512,7 @@ with st.sidebar:
                 )
                 
                 if new_qty != project["quantity"]:
-                    project["quantity"] = new_qty
+                    st.session_state.projects[i]["quantity"] = new_qty
                     save_projects()
             
             with col3:
@@ -315,6 +553,9 @@ with st.sidebar:
     
     # Quantity input
     new_projekt_anzahl = st.number_input("Anzahl:", min_value=1, value=1, step=1)
+
+    # Site input
+    new_projekt_standort = st.text_input("Standort:", value=DEFAULT_SITE)
     
     # Add Project and Settings buttons
     col1, col2 = st.columns([1, 1])
@@ -326,6 +567,7 @@ with st.sidebar:
             new_project = {
                 "name": new_projekt_name, 
                 "quantity": new_projekt_anzahl,
+                "site": new_projekt_standort or DEFAULT_SITE,
                 "stations": {
                     "Station 1": False,
                     "Station 2": False,
@@ -350,6 +592,7 @@ with st.sidebar:
                 st.session_state.temp_project = {
                     "name": new_projekt_name if new_projekt_name else "Neues Projekt",
                     "quantity": new_projekt_anzahl,
+                    "site": new_projekt_standort or DEFAULT_SITE,
                     "stations": {
                         "Station 1": False,
                         "Station 2": False,
@@ -370,9 +613,41 @@ with st.sidebar:
 # Main content area
 st.title("Mitarbeitereinsatz")
 
+# Edits that collide with changes another planner made at the same time
+for kind, overlay in (("projects", st.session_state.projects), ("employees", st.session_state.employee_data['employees'])):
+    for record_id in sorted(st.session_state.plan_conflicts[kind]):
+        mine = overlay.get_by_id(record_id)
+        record_name = f"Projekt „{mine['name']}“" if kind == "projects" else f"Mitarbeiter {mine['id']}"
+        if overlay.is_deleted(record_id):
+            st.warning(f"{record_name} wurde von einem anderen Planer geändert, während Sie es gelöscht haben.")
+        else:
+            st.warning(f"{record_name} wurde gleichzeitig von einem anderen Planer geändert.")
+        col1, col2, col3 = st.columns([1, 1, 2])
+        with col1:
+            if st.button("Meine Änderung behalten", key=f"keep_{kind}_{record_id}", use_container_width=True):
+                st.session_state.plan_conflicts[kind].discard(record_id)
+                save_projects()
+                st.rerun()
+        with col2:
+            if st.button("Andere Änderung übernehmen", key=f"take_{kind}_{record_id}", use_container_width=True):
+                # Taking back a deletion moves the projects after it, keep the selected one selected
+                project_ids = st.session_state.projects.ids()
+                selected_index = st.session_state.selected_project_index
+                selected_id = project_ids[selected_index] if selected_index is not None and selected_index < len(project_ids) else None
+                overlay.discard(record_id)
+                st.session_state.plan_conflicts[kind].discard(record_id)
+                if selected_id is not None:
+                    st.session_state.selected_project_index = st.session_state.projects.ids().index(selected_id)
+                st.rerun()
+
 # Define dialog function for project settings
+#
+# The dialog looks up the selected project on every run: its reruns are
+# fragment reruns with the original arguments, while the position of the
+# project can change when other planners add or delete projects.
 @st.dialog("Projektkonfiguration")
-def show_project_settings(project_index):
+def show_project_settings():
+    project_index = st.session_state.selected_project_index
     if project_index is not None and project_index < len(st.session_state.projects):
         selected_project = st.session_state.projects[project_index]
         
@@ -399,6 +674,18 @@ def show_project_settings(project_index):
         if new_name != selected_project['name']:
             selected_project['name'] = new_name
             save_projects()
+
+        # Site input field
+        new_site = st.text_input(
+            "Standort:",
+            value=get_site(selected_project),
+            key=f"site_project_{project_index}"
+        )
+
+        # Update project site if changed
+        if new_site and new_site != get_site(selected_project):
+            selected_project['site'] = new_site
+            save_projects()
         
         # Dialog content for stations
         st.subheader("Stationen")
@@ -453,6 +740,17 @@ def show_temp_project_settings():
         # Update project name if changed
         if new_name != st.session_state.temp_project['name']:
             st.session_state.temp_project['name'] = new_name
+
+        # Site input field for new project
+        new_site = st.text_input(
+            "Standort:",
+            value=get_site(st.session_state.temp_project),
+            key="temp_project_site"
+        )
+
+        # Update project site if changed
+        if new_site and new_site != get_site(st.session_state.temp_project):
+            st.session_state.temp_project['site'] = new_site
         
         # Dialog content for stations
         st.subheader("Stationen")
@@ -527,27 +825,49 @@ def show_employee_config():
             selected_employee_id = st.selectbox(
                 "Mitarbeiter auswählen:",
                 options=employee_ids,
-                format_func=lambda x: f"Mitarbeiter {x}"
+                format_func=lambda x: f"Mitarbeiter {x}",
+                key="selected_employee_id"
             )
             
         with col2:
             # Add new employee button next to the dropdown
             if st.button("➕ Neu", help="Neuen Mitarbeiter hinzufügen", use_container_width=True):
-                # Find the next available ID
-                next_id = max(employee_ids) + 1 if employee_ids else 1
+                # Get the next ID, unique across all sessions
+                next_id = get_plan_registry().new_employee_id()
                 # Add new employee
                 st.session_state.employee_data['employees'].append({
                     'id': next_id,
+                    'site': DEFAULT_SITE,
                     'stations': {}
                 })
                 st.rerun()
         
         st.divider()
         
-        # Find selected employee data
-        selected_employee = next((emp for emp in st.session_state.employee_data['employees'] if emp['id'] == selected_employee_id), None)
+        # Find selected employee data, accessing it by index copies it into this session's overlay
+        selected_employee = None
+        if selected_employee_id in employee_ids:
+            selected_employee = st.session_state.employee_data['employees'][employee_ids.index(selected_employee_id)]
         
         if selected_employee:
+            # Site of the employee
+            employee_site = st.text_input(
+                "Standort:",
+                value=get_site(selected_employee),
+                key=f"site_employee_{selected_employee_id}"
+            )
+            if employee_site:
+                selected_employee['site'] = employee_site
+
+            # Working hours available for the workload distribution
+            selected_employee['capacity_hours'] = st.number_input(
+                "Kapazität (Std)",
+                min_value=1,
+                max_value=168,
+                value=int(selected_employee.get('capacity_hours', DEFAULT_CAPACITY_HOURS)),
+                key=f"capacity_employee_{selected_employee_id}"
+            )
+
             # Update employee's station configurations
             st.subheader("Bearbeitungszeiten für Stationen")
             
@@ -607,6 +927,8 @@ def show_employee_config():
         col1, col2, col3 = st.columns([1, 1, 1])
         with col2:
             if st.button("Schließen", key="close_employee_config", use_container_width=True):
+                # Publish the changed processing times
+                save_projects()
                 st.session_state.show_employee_dialog = False
                 st.rerun()
 
@@ -623,7 +945,7 @@ def is_any_dialog_open():
 if st.session_state.show_employee_dialog:
     show_employee_config()
 elif st.session_state.selected_project_index is not None and st.session_state.show_settings_dialog:
-    show_project_settings(st.session_state.selected_project_index)
+    show_project_settings()
 elif 'temp_project_settings' in st.session_state and st.session_state.temp_project_settings:
     show_temp_project_settings()
 
@@ -685,15 +1007,24 @@ with st.sidebar:
                 imported_projects = import_from_excel(uploaded_file)
                 
                 if imported_projects and len(imported_projects) > 0:
-                    st.session_state.projects = imported_projects
+                    # The import replaces all projects of the shared plan
+                    get_plan_registry().replace(
+                        imported_projects,
+                        list(st.session_state.employee_data['employees']),
+                        author=st.session_state.session_token
+                    )
+                    open_plan_session()
                     st.session_state.selected_project_index = 0
-                    save_projects()
                     st.success("Projekte importiert!", icon="✅")
                     st.rerun()
                 else:
                     st.error("Keine gültigen Projekte in der Excel-Datei gefunden.")
             except Exception as e:
                 st.error(f"Fehler beim Import: {str(e)}")
+    
+    # Startup timing report, filled in at the end of the script run
+    st.divider()
+    timing_placeholder = st.empty()
 
 if st.session_state.projects:
     # Display welcome message when no results are shown yet
@@ -704,6 +1035,8 @@ else:
 
 # Results display
 if st.session_state.show_results:
+    pd = lazy_import("pandas")
+    
     # Display current projects first
     st.subheader("Aktuelle Projekte")
     
@@ -723,6 +1056,7 @@ if st.session_state.show_results:
             
         projects_data.append({
             "Projekt": p["name"],
+            "Standort": get_site(p),
             "Anzahl": p["quantity"],
             "Aktive Stationen": active_stations_count,
             "Ausgewählte Stationen": active_stations_text
@@ -738,111 +1072,111 @@ if st.session_state.show_results:
     # Calculation results
     st.subheader("Berechnungsergebnisse")
     
-    # Import for random number generation
-    import random
-    
-    # Get all unique active stations across all projects
-    all_stations = set()
-    for project in st.session_state.projects:
-        if 'stations' in project:
-            for station, is_active in project['stations'].items():
-                if is_active:
-                    all_stations.add(station)
+    # Fingerprint the sites from the base version and the session's changes, and
+    # only read and calculate the shards of sites whose fingerprint changed
+    projects = st.session_state.projects
+    employees = st.session_state.employee_data['employees']
+    site_results = calculate_sites(
+        site_fingerprints(projects, employees),
+        lambda sites: partition_by_site(projects, employees, sites),
+        st.session_state.shard_results,
+        get_executor()
+    )
     
-    if not all_stations:
+    if not any(result["station_results"] for result in site_results.values()):
         st.warning("Keine Stationen ausgewählt. Wählen Sie im Seitenmenü für mindestens ein Projekt Stationen aus.")
     else:
-        # Create results for each station based on employee data
-        station_results = []
+        # Display one table per site
+        for site, result in site_results.items():
+            if not result["station_results"]:
+                continue
+            st.markdown(f"#### {site}")
+            results_df = pd.DataFrame(result["station_results"])
+            st.table(results_df)
         
-        # Get employee assignments from employee_data
-        if 'employee_data' in st.session_state and 'employees' in st.session_state.employee_data:
-            employees = st.session_state.employee_data['employees']
-            
-            # For each active station, find assigned employees with processing times
-            for station in sorted(all_stations):
-                # Find employees assigned to this station
-                assigned_employees = []
-                for emp in employees:
-                    if 'stations' in emp and station in emp['stations']:
-                        assigned_employees.append({
-                            'id': emp['id'],
-                            'processing_time': emp['stations'][station].get('processing_time_minutes', 15)
-                        })
-                
-                # If no employees are assigned yet, generate a random assignment
-                if not assigned_employees:
-                    # Generate random number of employees (1-3)
-                    num_mitarbeiter = random.randint(1, 3)
-                    assigned_employee_ids = [f"Mitarbeiter {random.randint(1, 5)}" for _ in range(num_mitarbeiter)]
-                    
-                    station_results.append({
-                        "Station": station,
-                        "Mitarbeiter": ", ".join(assigned_employee_ids),
-                        "Bearbeitungszeit (Min)": random.randint(5, 30)
-                    })
-                else:
-                    # Use actual employee assignments
-                    employee_ids = [f"Mitarbeiter {emp['id']}" for emp in assigned_employees]
-                    avg_processing_time = sum(emp['processing_time'] for emp in assigned_employees) / len(assigned_employees)
-                    
-                    station_results.append({
-                        "Station": station,
-                        "Mitarbeiter": ", ".join(employee_ids),
-                        "Bearbeitungszeit (Min)": round(avg_processing_time, 1)
-                    })
-        else:
-            # Fallback if no employee data is available
-            for station in sorted(all_stations):
-                # Generate random number of employees (1-3)
-                num_mitarbeiter = random.randint(1, 3)
-                assigned_employee_ids = [f"Mitarbeiter {random.randint(1, 5)}" for _ in range(num_mitarbeiter)]
-                
-                station_results.append({
-                    "Station": station,
-                    "Mitarbeiter": ", ".join(assigned_employee_ids),
-                    "Bearbeitungszeit (Min)": random.randint(5, 30)
+        # Summary statistics
+        st.subheader("Zusammenfassung")
+        
+        summary = merge_results(site_results)
+
+        st.write(f"Anzahl Standorte: **{summary['total_sites']}**")
+        st.write(f"Anzahl Stationen: **{summary['total_stations']}**")
+        st.write(f"Beteiligte Mitarbeiter insgesamt: **{summary['total_employees']}**")
+        st.write(f"Durchschnittliche Bearbeitungszeit: **{round(summary['avg_processing_time'], 1)} Min**")
+        st.write(f"Verteilte Arbeitslast: **{round(summary['total_hours'], 1)} Std**")
+        st.write(f"Überlastete Mitarbeiter: **{summary['overloaded_employees']}** ({round(summary['total_overload_hours'], 1)} Std über Kapazität)")
+        
+        # Workload per employee from the load balancer, most loaded first
+        st.subheader("Auslastung der Mitarbeiter")
+        
+        employee_load_data = []
+        for site, result in site_results.items():
+            for load in result["employee_load"]:
+                employee_load_data.append({
+                    "Standort": site,
+                    "Mitarbeiter": f"Mitarbeiter {load['id']}",
+                    "Stunden": round(load["hours"], 1),
+                    "Kapazität (Std)": round(load["capacity_hours"], 1),
+                    "Auslastung (%)": round(load["utilization"] * 100),
+                    "Überlast (Std)": round(load["overload_hours"], 1)
                 })
         
-        # Create DataFrame and display table
-        results_df = pd.DataFrame(station_results)
-        st.table(results_df)
+        if employee_load_data:
+            employee_load_df = pd.DataFrame(employee_load_data).sort_values("Auslastung (%)", ascending=False)
+            st.dataframe(employee_load_df, hide_index=True, use_container_width=True)
+        else:
+            st.info("Keine Mitarbeiter konfiguriert.")
         
-        # Summary statistics
-        st.subheader("Zusammenfassung")
+        # Timeline of the calculated plan
+        st.subheader("Zeitplan")
         
-        # Count unique employees and collect employee IDs
-        all_employees = set()
-        employee_ids = set()
-        for result in station_results:
-            emp_list = result["Mitarbeiter"].split(", ")
-            for emp in emp_list:
-                all_employees.add(emp)
-                # Extract employee ID number
-                if emp.startswith("Mitarbeiter "):
-                    try:
-                        emp_id = int(emp.replace("Mitarbeiter ", ""))
-                        employee_ids.add(emp_id)
-                    except ValueError:
-                        pass
-        
-        # Update employee_data to include all employees from calculation results
-        if 'employee_data' in st.session_state:
-            existing_ids = {emp['id'] for emp in st.session_state.employee_data['employees']}
-            for emp_id in employee_ids:
-                if emp_id not in existing_ids:
-                    # Add missing employees to the employee_data
-                    st.session_state.employee_data['employees'].append({
-                        'id': emp_id,
-                        'stations': {}
-                    })
-        
-        total_mitarbeiter = len(all_employees)
-        total_stations = len(station_results)
-        
-        # Calculate average processing time
-        avg_time = sum(result["Bearbeitungszeit (Min)"] for result in station_results) / len(station_results) if station_results else 0
-        
-        st.write(f"Anzahl Stationen: **{total_stations}**")
-        st.write(f"Beteiligte Mitarbeiter insgesamt: **{total_mitarbeiter}**")
-        st.write(f"Durchschnittliche Bearbeitungszeit: **{round(avg_time, 1)} Min**")
+        horizon = max((task[4] for result in site_results.values() for task in result["tasks"]), default=0) / 60
+        if horizon > 0:
+            max_hours = float(round(horizon + 0.5))
+            # Reset the zoom when the plan got shorter than the stored window
+            if st.session_state.get("timeline_window", (0.0, 0.0))[1] > max_hours:
+                del st.session_state["timeline_window"]
+            
+            col1, col2 = st.columns([1, 3])
+            with col1:
+                timeline_view = st.radio("Ansicht", ["Stationen", "Mitarbeiter"], horizontal=True, key="timeline_view")
+            with col2:
+                window_start, window_end = st.slider(
+                    "Zeitfenster (Std)",
+                    min_value=0.0,
+                    max_value=max_hours,
+                    value=(0.0, max_hours),
+                    step=0.5,
+                    key="timeline_window"
+                )
+            
+            if window_end > window_start:
+                fig, timeline = create_timeline_chart(site_results, timeline_view, window_start, window_end)
+                if timeline["aggregated"]:
+                    st.caption(f"{timeline['total_tasks']} Aufgaben im Zeitfenster, zusammengefasst in {len(timeline['bars'])} Zeitabschnitte. Zoomen Sie hinein, um einzelne Aufgaben zu sehen.")
+                else:
+                    st.caption(f"{timeline['total_tasks']} Aufgaben im Zeitfenster")
+                if timeline["hidden_lanes"]:
+                    st.caption(f"{timeline['hidden_lanes']} weniger ausgelastete Zeilen ausgeblendet")
+                st.plotly_chart(fig, use_container_width=True)
+
+# Startup timing report
+run_seconds = time.perf_counter() - _script_start
+if 'first_render_seconds' not in st.session_state:
+    st.session_state.first_render_seconds = run_seconds
+startup_timings = get_startup_timings()
+startup_timings.setdefault("Erster Seitenaufbau", run_seconds)
+with timing_placeholder.expander("⏱️ Startzeit"):
+    # Other sessions can add timings while this one iterates
+    for label, seconds in list(startup_timings.items()):
+        st.write(f"{label}: **{seconds * 1000:.0f} ms**")
+    st.write(f"Erster Seitenaufbau dieser Sitzung: **{st.session_state.first_render_seconds * 1000:.0f} ms**")
+    st.write(f"Dieser Durchlauf: **{run_seconds * 1000:.0f} ms**")
+
+# Rerun the session as soon as another planner published a new version
+@st.fragment(run_every="3s")
+def watch_plan_changes():
+    if get_latest_plan_version() != st.session_state.plan_version and not is_any_dialog_open():
+        st.rerun()
+
+watch_plan_changes()
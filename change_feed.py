@@ -0,0 +1,46 @@
+import os
+
+# Change feed for the plan files.
+#
+# A watchdog observer reloads the registry as soon as the snapshot or the
+# employee file is written by somebody else. The registry records the ids of
+# the changed records in its journal and open sessions apply just those on
+# their next run. Without watchdog the sessions poll the file state instead.
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    FileSystemEventHandler = object
+    Observer = None
+
+
+class _PlanFileHandler(FileSystemEventHandler):
+    def __init__(self, registry):
+        self._registry = registry
+        self._paths = {
+            os.path.abspath(registry.snapshot_path),
+            os.path.abspath(registry.employee_path)
+        }
+
+    def on_any_event(self, event):
+        # Files are replaced atomically, so the final path shows up as dest_path of a move
+        paths = {os.path.abspath(event.src_path), os.path.abspath(getattr(event, "dest_path", "") or event.src_path)}
+        if paths & self._paths:
+            try:
+                self._registry.reload_if_changed()
+            except Exception:
+                # A half written file from another writer, the next event picks it up
+                pass
+
+
+# Function to start watching the plan files, returns None if watchdog is not installed
+def watch_plan_files(registry):
+    if Observer is None:
+        return None
+    observer = Observer()
+    directory = os.path.dirname(os.path.abspath(registry.snapshot_path))
+    observer.schedule(_PlanFileHandler(registry), directory, recursive=False)
+    observer.daemon = True
+    observer.start()
+    return observer
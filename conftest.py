@@ -0,0 +1 @@
+# Lets the tests import the app modules, which live in the repository root
@@ -0,0 +1,239 @@
+import heapq
+import random
+import time
+
+# Weekly capacity of an employee without a configured value
+DEFAULT_CAPACITY_HOURS = 40
+
+# Upper bound for the time the local search may spend on one site
+LOCAL_SEARCH_SECONDS = 1.0
+
+# Local search time per job, small sites finish well below the upper bound
+LOCAL_SEARCH_SECONDS_PER_JOB = 0.00001
+
+# Number of jobs looked at per move or swap attempt
+_CANDIDATES = 32
+
+
+# Function to distribute the workload of one site between its employees
+#
+# Every active station of a project is a job of quantity x processing time
+# minutes, where the processing time depends on the employee doing it. Only
+# employees configured for a station can take its jobs, and an employee's
+# jobs add up across all stations. The load of an employee is measured
+# relative to their capacity.
+#
+# A heap-based LPT pass assigns the longest jobs first, each to the
+# qualified employee whose relative load is lowest after taking the job. A
+# local search then moves single jobs away from the most loaded employee or
+# swaps jobs with another employee until no step lowers the maximum load or
+# its time is over: LOCAL_SEARCH_SECONDS_PER_JOB per job, at most time_limit
+# seconds.
+def balance_workload(projects, employees, time_limit=LOCAL_SEARCH_SECONDS):
+    emp_ids = [emp['id'] for emp in employees]
+    capacity = [max(float(emp.get('capacity_hours', DEFAULT_CAPACITY_HOURS)), 1.0) * 60 for emp in employees]
+    emp_minutes = [
+        {station: settings.get('processing_time_minutes', 15) for station, settings in emp.get('stations', {}).items()}
+        for emp in employees
+    ]
+    qualified = {}
+    for e, minutes in enumerate(emp_minutes):
+        for station in minutes:
+            qualified.setdefault(station, []).append(e)
+
+    # Collect the jobs, stations without qualified employees stay unassigned
+    job_project = []
+    job_station = []
+    job_quantity = []
+    unassigned = {}
+    for position, project in enumerate(projects):
+        for station, is_active in project.get('stations', {}).items():
+            if not is_active:
+                continue
+            if station not in qualified:
+                unassigned[station] = unassigned.get(station, 0) + project["quantity"]
+                continue
+            job_project.append(position)
+            job_station.append(station)
+            job_quantity.append(project["quantity"])
+
+    load = [0.0] * len(employees)
+    assignment = [None] * len(job_station)
+    emp_jobs = [[] for _ in employees]
+    job_slot = [0] * len(job_station)
+
+    def duration(j, e):
+        return job_quantity[j] * emp_minutes[e][job_station[j]]
+
+    def assign(j, e):
+        assignment[j] = e
+        job_slot[j] = len(emp_jobs[e])
+        emp_jobs[e].append(j)
+        load[e] += duration(j, e)
+
+    def unassign(j):
+        e = assignment[j]
+        # Swap-remove so taking a job away is O(1)
+        last = emp_jobs[e].pop()
+        if last != j:
+            emp_jobs[e][job_slot[j]] = last
+            job_slot[last] = job_slot[j]
+        load[e] -= duration(j, e)
+
+    # Heaps of (relative load, employee, stamp): one per station, and per
+    # station one per speed, the relative processing time minutes / capacity.
+    # Taking a job of quantity q raises an employee's relative load by
+    # q * speed, so within a speed group the least loaded employee is the best
+    # choice, and a job only has to compare the group leaders. peak_heap holds
+    # (-relative load, employee, stamp) over all employees. Whenever a load
+    # changes the employee gets a new stamp and fresh entries; entries with an
+    # old stamp are outdated and skipped when they come up.
+    stamp = [0] * len(employees)
+    heaps = {}
+    speed_heaps = {}
+    emp_heaps = [[] for _ in employees]
+    # All loads start at 0 and members are in employee order, so the lists are valid heaps
+    for station, members in qualified.items():
+        heaps[station] = [(0.0, e, 0) for e in members]
+        groups = {}
+        for e in members:
+            groups.setdefault(emp_minutes[e][station] / capacity[e], []).append((0.0, e, 0))
+        if len(groups) == 1:
+            # Everybody works at the same speed, the station heap is the only group
+            groups = {speed: heaps[station] for speed in groups}
+        for e in members:
+            emp_heaps[e].append(heaps[station])
+        if len(groups) > 1:
+            for heap in groups.values():
+                for _, e, _ in heap:
+                    emp_heaps[e].append(heap)
+        speed_heaps[station] = sorted(groups.items(), key=lambda item: item[0])
+    peak_heap = [(0.0, e, 0) for e in range(len(employees))]
+
+    def touch(e):
+        stamp[e] += 1
+        relative = load[e] / capacity[e]
+        for heap in emp_heaps[e]:
+            heapq.heappush(heap, (relative, e, stamp[e]))
+        heapq.heappush(peak_heap, (-relative, e, stamp[e]))
+
+    def least_loaded(heap, exclude=None):
+        skipped = None
+        while heap:
+            _, f, entry_stamp = heap[0]
+            if entry_stamp != stamp[f]:
+                heapq.heappop(heap)
+            elif f == exclude:
+                skipped = heapq.heappop(heap)
+            else:
+                break
+        result = heap[0][:2] if heap else None
+        if skipped is not None:
+            heapq.heappush(heap, skipped)
+        return result
+
+    # Function to find the qualified employee with the lowest relative load after taking job j
+    def best_employee(j, exclude=None):
+        station = job_station[j]
+        quantity = job_quantity[j]
+        lowest = least_loaded(heaps[station], exclude)
+        if lowest is None:
+            return None
+        # Start with the least loaded employee, only faster groups can beat them
+        best = (lowest[0] + quantity * emp_minutes[lowest[1]][station] / capacity[lowest[1]], lowest[1])
+        for speed, heap in speed_heaps[station]:
+            if lowest[0] + quantity * speed >= best[0]:
+                break
+            leader = heap[0]
+            # The top entry is usually current, only clean up the heap when it is not
+            if leader[2] != stamp[leader[1]] or leader[1] == exclude:
+                leader = least_loaded(heap, exclude)
+                if leader is None:
+                    continue
+            if leader[0] + quantity * speed < best[0]:
+                best = (leader[0] + quantity * speed, leader[1])
+        return best[1]
+
+    # Greedy LPT pass: longest jobs first, each to the employee that ends up least loaded
+    fastest = {station: min(emp_minutes[e][station] for e in members) for station, members in qualified.items()}
+    order = sorted(range(len(job_station)), key=lambda j: -job_quantity[j] * fastest[job_station[j]])
+    for j in order:
+        e = best_employee(j)
+        assign(j, e)
+        touch(e)
+
+    # Local search on the most loaded employee
+    rng = random.Random(0)
+    deadline = time.perf_counter() + min(time_limit, LOCAL_SEARCH_SECONDS_PER_JOB * len(job_station))
+    while peak_heap and job_station and time.perf_counter() < deadline:
+        while peak_heap[0][2] != stamp[peak_heap[0][1]]:
+            heapq.heappop(peak_heap)
+        e = peak_heap[0][1]
+        current = load[e] / capacity[e]
+        jobs = emp_jobs[e]
+        candidates = jobs if len(jobs) <= _CANDIDATES else rng.sample(jobs, _CANDIDATES)
+        best = None
+
+        # Move a job to the other employee that ends up least loaded with it
+        for j in candidates:
+            f = best_employee(j, exclude=e)
+            if f is None:
+                continue
+            peak = max((load[e] - duration(j, e)) / capacity[e], (load[f] + duration(j, f)) / capacity[f])
+            if peak < current - 1e-9 and (best is None or peak < best[0]):
+                best = (peak, j, f, None)
+
+        # Otherwise swap a job with one of another employee
+        if best is None:
+            for j in candidates[:_CANDIDATES // 4]:
+                for f in rng.sample(qualified[job_station[j]], min(len(qualified[job_station[j]]), _CANDIDATES // 4)):
+                    if f == e or not emp_jobs[f]:
+                        continue
+                    others = emp_jobs[f] if len(emp_jobs[f]) <= _CANDIDATES // 4 else rng.sample(emp_jobs[f], _CANDIDATES // 4)
+                    for k in others:
+                        if job_station[k] not in emp_minutes[e]:
+                            continue
+                        peak = max(
+                            (load[e] - duration(j, e) + duration(k, e)) / capacity[e],
+                            (load[f] - duration(k, f) + duration(j, f)) / capacity[f]
+                        )
+                        if peak < current - 1e-9 and (best is None or peak < best[0]):
+                            best = (peak, j, f, k)
+
+        if best is None:
+            break
+        _, j, f, k = best
+        unassign(j)
+        if k is not None:
+            unassign(k)
+            assign(k, e)
+        assign(j, f)
+        touch(e)
+        touch(f)
+
+    # Per employee and per station report
+    station_minutes = {}
+    for j, e in enumerate(assignment):
+        per_station = station_minutes.setdefault(job_station[j], {})
+        per_station[emp_ids[e]] = per_station.get(emp_ids[e], 0) + duration(j, e)
+
+    employee_report = []
+    for e, emp_id in enumerate(emp_ids):
+        hours = load[e] / 60
+        capacity_hours = capacity[e] / 60
+        employee_report.append({
+            "id": emp_id,
+            "hours": hours,
+            "capacity_hours": capacity_hours,
+            "utilization": hours / capacity_hours,
+            "overload_hours": max(hours - capacity_hours, 0)
+        })
+
+    return {
+        "employees": employee_report,
+        "stations": station_minutes,
+        "unassigned_quantity": unassigned,
+        "assignment": {
+            (job_project[j], job_station[j]): emp_ids[e] for j, e in enumerate(assignment)
+        }
+    }
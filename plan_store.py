@@ -0,0 +1,531 @@
+import contextlib
+import copy
+import hashlib
+import json
+import os
+import threading
+from collections.abc import MutableSequence
+
+from search_index import ProjectIndex, search_changes, types_with_changes
+from sites import get_site
+from snapshot import ProjectSnapshot, patch_snapshot, replace_file, write_snapshot
+
+try:
+    import fcntl
+except ImportError:
+    # Without fcntl (Windows) the registry only locks out other threads
+    fcntl = None
+
+# Number of versions the registry remembers the changed record ids for
+JOURNAL_LENGTH = 200
+
+
+# Read-only access to the projects of a base plan by record id
+class _ProjectRows:
+    def __init__(self, snapshot, site_versions):
+        self._snapshot = snapshot
+        self.site_versions = site_versions
+        self.ids = snapshot.ids()
+        self._positions = None
+        self._search_index = None
+        self._lock = threading.Lock()
+
+    def _position_map(self):
+        # Build the id -> row map once, it is shared by all sessions on this base
+        if self._positions is None:
+            with self._lock:
+                if self._positions is None:
+                    self._positions = {record_id: i for i, record_id in enumerate(self.ids)}
+        return self._positions
+
+    # Function to get the search index over the projects, built on first use and shared by all sessions on this base
+    def search_index(self):
+        if self._search_index is None:
+            with self._lock:
+                if self._search_index is None:
+                    self._search_index = ProjectIndex(self._snapshot)
+        return self._search_index
+
+    def has_search_index(self):
+        return self._search_index is not None
+
+    def __contains__(self, record_id):
+        return record_id in self._position_map()
+
+    def position(self, record_id):
+        return self._position_map()[record_id]
+
+    # Function to decode a project, every call returns a new dict
+    def row(self, record_id):
+        return self._snapshot[self._position_map()[record_id]]
+
+
+# Read-only access to the employees of a base plan by employee id
+class _EmployeeRows:
+    def __init__(self, employees):
+        self._employees = {emp['id']: emp for emp in employees}
+        self.ids = list(self._employees)
+
+    def __contains__(self, record_id):
+        return record_id in self._employees
+
+    # Function to copy an employee, the shared base dict is never handed out
+    def row(self, record_id):
+        return copy.deepcopy(self._employees[record_id])
+
+
+# Immutable version of the plan shared by all sessions
+#
+# site_versions maps every site to the version that last changed one of its
+# projects or employees. Sites not in changed_sites keep the version they had
+# in previous; without previous or changed_sites every site counts as changed.
+class BasePlan:
+    def __init__(self, version, snapshot, employees, previous=None, changed_sites=None):
+        self.version = version
+        self.snapshot = snapshot
+        sites = snapshot.used_sites() | {get_site(emp) for emp in employees}
+        if previous is None or changed_sites is None:
+            self.site_versions = dict.fromkeys(sites, version)
+        else:
+            self.site_versions = {
+                site: version if site in changed_sites else previous.site_versions.get(site, version)
+                for site in sites
+            }
+        self.projects = _ProjectRows(snapshot, self.site_versions)
+        self.employees = _EmployeeRows(employees)
+
+
+# Copy-on-write list of the records of a session on top of a base plan.
+#
+# The session only keeps what it changed: _rows holds the records that were
+# accessed by index (the write path) or added, until prune() drops the ones
+# that are still equal to the base, and _deleted the base records it
+# removed. _order is the base id list itself until the first insert or
+# delete. Iterating and get() decode untouched records on the fly without
+# keeping them, so looking at the plan does not grow the overlay.
+class OverlayList(MutableSequence):
+    def __init__(self, base_rows, new_key):
+        self._new_key = new_key
+        self._set_base(base_rows)
+
+    def _set_base(self, base_rows):
+        self._base = base_rows
+        self._order = base_rows.ids
+        self._order_shared = True
+        self._rows = {}
+        self._deleted = set()
+
+    def _own_order(self):
+        if self._order_shared:
+            self._order = list(self._order)
+            self._order_shared = False
+
+    def __len__(self):
+        return len(self._order)
+
+    # Function to read a record without copying it into the overlay
+    def get(self, i):
+        record_id = self._order[i]
+        row = self._rows.get(record_id)
+        return row if row is not None else self._base.row(record_id)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self._order)))]
+        record_id = self._order[i]
+        if record_id not in self._rows:
+            self._rows[record_id] = self._base.row(record_id)
+        return self._rows[record_id]
+
+    def __setitem__(self, i, row):
+        self._rows[self._order[i]] = row
+
+    def __delitem__(self, i):
+        self._own_order()
+        record_id = self._order.pop(i)
+        self._rows.pop(record_id, None)
+        if record_id in self._base:
+            self._deleted.add(record_id)
+
+    def insert(self, i, row):
+        self._own_order()
+        record_id = self._new_key(row)
+        self._order.insert(i, record_id)
+        self._rows[record_id] = row
+
+    def __iter__(self):
+        for record_id in self._order:
+            row = self._rows.get(record_id)
+            yield row if row is not None else self._base.row(record_id)
+
+    def ids(self):
+        return list(self._order)
+
+    # Function to read a record by id, including local changes
+    def get_by_id(self, record_id):
+        row = self._rows.get(record_id)
+        return row if row is not None else self._base.row(record_id)
+
+    # Function to read a record as it is in the base this overlay is on
+    def base_row(self, record_id):
+        return self._base.row(record_id)
+
+    def is_deleted(self, record_id):
+        return record_id in self._deleted
+
+    # Function to drop the local changes of a record and use the base version again
+    def discard(self, record_id):
+        if record_id in self._base:
+            self._rows.pop(record_id, None)
+        if record_id in self._deleted:
+            # Put the record back after the base records that come before it
+            self._deleted.discard(record_id)
+            base_ids = self._base.ids
+            earlier = set(base_ids[:base_ids.index(record_id)])
+            self._own_order()
+            self._order.insert(sum(1 for other in self._order if other in earlier), record_id)
+
+    # Function to drop the records the session holds without changes, except the ids in keep
+    def prune(self, keep=()):
+        for record_id, row in list(self._rows.items()):
+            if record_id in self._base and record_id not in keep and row == self._base.row(record_id):
+                del self._rows[record_id]
+
+    # Function to get the uncommitted changes as (modified, added, deleted)
+    def changes(self):
+        modified = {}
+        added = {}
+        for record_id, row in self._rows.items():
+            if record_id not in self._base:
+                added[record_id] = row
+            elif row != self._base.row(record_id):
+                modified[record_id] = row
+        return modified, added, set(self._deleted)
+
+    # Function to move the overlay onto a newer base, keeping the uncommitted changes
+    #
+    # Returns (conflicts, dropped): the locally modified or deleted records
+    # that were also changed in the new base, and the locally modified or
+    # deleted records that the new base deleted. Conflicting records keep the
+    # local version. Records the
+    # session holds without changes are updated in place, so dicts handed out
+    # before (e.g. to an open dialog) stay part of the overlay.
+    def rebase(self, base_rows):
+        modified, added, deleted = self.changes()
+        old_base = self._base
+        rows = self._rows
+        self._set_base(base_rows)
+        dropped = {record_id for record_id in deleted if record_id not in base_rows}
+        deleted = {record_id for record_id in deleted if record_id in base_rows}
+        conflicts = {record_id for record_id in deleted if base_rows.row(record_id) != old_base.row(record_id)}
+        for record_id, row in rows.items():
+            if record_id in added and record_id not in base_rows:
+                continue
+            # Records deleted in the new base stay deleted
+            if record_id not in base_rows:
+                if record_id in modified:
+                    dropped.add(record_id)
+                continue
+            new_row = base_rows.row(record_id)
+            if record_id in modified:
+                if row != new_row and new_row != old_base.row(record_id):
+                    conflicts.add(record_id)
+            elif row != new_row:
+                row.clear()
+                row.update(new_row)
+            self._rows[record_id] = row
+        added = {record_id: row for record_id, row in added.items() if record_id not in base_rows}
+        if deleted or added:
+            self._order = [record_id for record_id in base_rows.ids if record_id not in deleted] + list(added)
+            self._order_shared = False
+        self._rows.update(added)
+        self._deleted = deleted
+        return conflicts, dropped
+
+
+# Function to apply the changes of an overlay to the records of a base plan
+def _merge(base_rows, modified, added, deleted):
+    ids = []
+    rows = []
+    for record_id in base_rows.ids:
+        if record_id in deleted:
+            continue
+        ids.append(record_id)
+        rows.append(modified[record_id] if record_id in modified else base_rows.row(record_id))
+    for record_id, row in added.items():
+        if record_id not in base_rows:
+            ids.append(record_id)
+            rows.append(row)
+    return ids, rows
+
+
+# Function to get the ids of all records that differ between two bases
+def _diff(old_rows, new_rows):
+    changed = set(old_rows.ids).symmetric_difference(new_rows.ids)
+    for record_id in new_rows.ids:
+        if record_id in old_rows and record_id not in changed and old_rows.row(record_id) != new_rows.row(record_id):
+            changed.add(record_id)
+    return changed
+
+
+# Function to get the sites touched by the changes of an overlay, before and after the change
+def _changed_sites(base_rows, modified, added, deleted):
+    sites = {get_site(row) for row in list(modified.values()) + list(added.values())}
+    for record_id in set(modified) | set(deleted):
+        if record_id in base_rows:
+            sites.add(get_site(base_rows.row(record_id)))
+    return sites
+
+
+# Function to fingerprint the sites of a session
+#
+# A site's fingerprint is the base version that last changed the site plus
+# the session's uncommitted changes to its records. Only the overlays are
+# looked at, so this stays cheap however large the plan is. Returns
+# {site: fingerprint} sorted by site.
+def site_fingerprints(projects, employees):
+    changes = {}
+    for kind, overlay in (("projects", projects), ("employees", employees)):
+        modified, added, deleted = overlay.changes()
+        for record_id, row in list(modified.items()) + list(added.items()):
+            sites = {get_site(row)}
+            if record_id in modified:
+                sites.add(get_site(overlay.base_row(record_id)))
+            for site in sites:
+                changes.setdefault(site, []).append((kind, record_id, row))
+        for record_id in deleted:
+            changes.setdefault(get_site(overlay.base_row(record_id)), []).append((kind, record_id, None))
+
+    site_versions = projects._base.site_versions
+    fingerprints = {}
+    for site in sorted(set(site_versions) | set(changes)):
+        site_changes = sorted(changes.get(site, []), key=lambda change: (change[0], change[1]))
+        data = json.dumps([site_versions.get(site), site_changes], sort_keys=True, default=str).encode("utf-8")
+        fingerprints[site] = hashlib.sha1(data).hexdigest()
+    return fingerprints
+
+
+# Function to search the projects of a session, returns positions in the session's list
+#
+# The index over the base plan is shared, the session's uncommitted changes
+# are matched on top of it (see search_index.search_changes).
+def search_projects(projects, text="", type_prefix=None, stations=()):
+    base_rows = projects._base
+    return search_changes(base_rows.search_index(), base_rows.ids, projects._order, projects.changes(), text, type_prefix, stations)
+
+
+# Function to get the project types of a session, empty until the shared index was built
+def project_types(projects):
+    base_rows = projects._base
+    if not base_rows.has_search_index():
+        return []
+    return types_with_changes(base_rows.search_index(), base_rows, projects.changes())
+
+
+# Function to hold the lock file of the plan files, locks out every process using them
+@contextlib.contextmanager
+def _file_lock(path):
+    if fcntl is None:
+        yield
+        return
+    with open(path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+        # Closing the file releases the lock
+
+
+# Function to find the modified and deleted records that changed in the latest base since the overlay's base
+def _conflicts(latest_rows, overlay, modified, deleted):
+    conflicts = set()
+    for record_id in modified:
+        if record_id not in latest_rows or latest_rows.row(record_id) != overlay.base_row(record_id):
+            conflicts.add(record_id)
+    # A record deleted in both is no conflict
+    for record_id in deleted:
+        if record_id in latest_rows and latest_rows.row(record_id) != overlay.base_row(record_id):
+            conflicts.add(record_id)
+    return conflicts
+
+
+# Process-wide holder of the current base plan.
+#
+# Sessions read self.base and keep their edits in OverlayLists. commit()
+# merges a session's changes onto the latest base, writes the files and swaps
+# in the new base under the lock, so concurrent commits never overwrite each
+# other's records and readers always see a complete version. Other processes
+# are locked out through the lock file next to the snapshot while the files
+# are read or written.
+#
+# Every new version is recorded in a short journal with the ids of the
+# changed records, so sessions can pick up only what changed. Files written
+# by somebody else (another server process or a manual edit) are noticed by
+# reload_if_changed(), which the change feed calls.
+class PlanRegistry:
+    def __init__(self, snapshot_path, employee_path):
+        self.snapshot_path = snapshot_path
+        self.employee_path = employee_path
+        self.lock_path = f"{snapshot_path}.lock"
+        self.base = None
+        self._lock = threading.Lock()
+        self._next_project_id = 1
+        self._next_employee_id = 1
+        self._journal = []
+        self._file_state = None
+        with _file_lock(self.lock_path):
+            if os.path.exists(snapshot_path):
+                self._load(1)
+
+    def _read_file_state(self):
+        state = []
+        for path in (self.snapshot_path, self.employee_path):
+            try:
+                stat = os.stat(path)
+                # Writers replace the files, so a new inode also marks a change
+                state.append((stat.st_ino, stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                state.append(None)
+        return tuple(state)
+
+    def _load(self, version, changed_sites=None):
+        employees = []
+        if os.path.exists(self.employee_path):
+            with open(self.employee_path, "r") as f:
+                employees = json.load(f)
+        self._file_state = self._read_file_state()
+        self.base = BasePlan(version, ProjectSnapshot(self.snapshot_path), employees, self.base, changed_sites)
+        self._next_project_id = max(self._next_project_id, max(self.base.projects.ids, default=0) + 1)
+        self._next_employee_id = max(self._next_employee_id, max(self.base.employees.ids, default=0) + 1)
+
+    def _record(self, author, project_ids, employee_ids):
+        self._journal.append((self.base.version, author, project_ids, employee_ids))
+        del self._journal[:-JOURNAL_LENGTH]
+
+    def _write_employees(self, employees):
+        with replace_file(self.employee_path, "w") as f:
+            json.dump(employees, f)
+
+    def new_project_id(self):
+        with self._lock:
+            record_id = self._next_project_id
+            self._next_project_id += 1
+            return record_id
+
+    def new_employee_id(self):
+        with self._lock:
+            record_id = self._next_employee_id
+            self._next_employee_id += 1
+            return record_id
+
+    # Function to replace the whole plan, e.g. on first start or on import
+    def replace(self, projects, employees, author=None):
+        with self._lock, _file_lock(self.lock_path):
+            projects = list(projects)
+            project_ids = list(range(self._next_project_id, self._next_project_id + len(projects)))
+            self._next_project_id += len(projects)
+            write_snapshot(self.snapshot_path, projects, project_ids)
+            self._write_employees(list(employees))
+            self._load(self.base.version + 1 if self.base is not None else 1)
+            # None marks that every record may have changed
+            self._record(author, None, None)
+            return self.base
+
+    # Function to publish the changes of a session as a new base version
+    #
+    # Modified or deleted records that changed in the latest base since the
+    # session's base are conflicts: they are not committed and returned as
+    # {"projects": ids, "employees": ids} so the session can ask the user.
+    # Records listed in skip (same shape) are left out as well.
+    def commit(self, projects, employees, author=None, skip=None):
+        skip = skip or {}
+        project_changes = projects.changes()
+        employee_changes = employees.changes()
+        conflicts = {"projects": set(), "employees": set()}
+        if not any(project_changes) and not any(employee_changes):
+            return self.base, conflicts
+        with self._lock, _file_lock(self.lock_path):
+            # A write by another process that the change feed has not reported
+            # yet must become the latest base, or it would be overwritten
+            self._reload_locked()
+            for kind, overlay, (modified, added, deleted), latest_rows in (
+                ("projects", projects, project_changes, self.base.projects),
+                ("employees", employees, employee_changes, self.base.employees),
+            ):
+                conflicts[kind] = _conflicts(latest_rows, overlay, modified, deleted)
+                for record_id in conflicts[kind] | set(skip.get(kind, ())):
+                    modified.pop(record_id, None)
+                    deleted.discard(record_id)
+                # Another process can have handed out the same new id, such records get the next free one
+                for record_id in [record_id for record_id in added if record_id in latest_rows]:
+                    row = added.pop(record_id)
+                    if kind == "projects":
+                        added[self._next_project_id] = row
+                        self._next_project_id += 1
+                    else:
+                        added[self._next_employee_id] = dict(row, id=self._next_employee_id)
+                        self._next_employee_id += 1
+            if not any(project_changes) and not any(employee_changes):
+                return self.base, conflicts
+
+            changed_sites = _changed_sites(self.base.projects, *project_changes) | _changed_sites(self.base.employees, *employee_changes)
+            if any(project_changes):
+                # Only the changed rows are encoded, the rest is copied from the mapped file
+                modified, added, deleted = project_changes
+                base_projects = self.base.projects
+                patch_snapshot(
+                    self.snapshot_path,
+                    self.base.snapshot,
+                    {base_projects.position(record_id): row for record_id, row in modified.items()},
+                    [(record_id, row) for record_id, row in added.items() if record_id not in base_projects],
+                    {base_projects.position(record_id) for record_id in deleted if record_id in base_projects}
+                )
+            if any(employee_changes):
+                self._write_employees(_merge(self.base.employees, *employee_changes)[1])
+            self._load(self.base.version + 1, changed_sites)
+            self._record(
+                author,
+                set(project_changes[0]) | set(project_changes[1]) | project_changes[2],
+                set(employee_changes[0]) | set(employee_changes[1]) | employee_changes[2]
+            )
+            return self.base, conflicts
+
+    # Function to load the files again if somebody else wrote them
+    def reload_if_changed(self):
+        with self._lock, _file_lock(self.lock_path):
+            return self._reload_locked()
+
+    def _reload_locked(self):
+        if self.base is None or not os.path.exists(self.snapshot_path):
+            return False
+        if self._read_file_state() == self._file_state:
+            return False
+        old_base = self.base
+        self._load(old_base.version + 1)
+        self._record(None, _diff(old_base.projects, self.base.projects), _diff(old_base.employees, self.base.employees))
+        return True
+
+    # Function to get the ids of the records changed after the given version
+    #
+    # Returns {"projects": ids, "employees": ids, "foreign": number of records
+    # changed by others than author}, or None if the journal does not reach
+    # back far enough or a version replaced the whole plan.
+    def changes_since(self, version, author=None):
+        latest = self.base.version
+        entries = [entry for entry in list(self._journal) if version < entry[0] <= latest]
+        if len(entries) != latest - version:
+            return None
+        changes = {"projects": set(), "employees": set(), "foreign": 0}
+        for _, entry_author, project_ids, employee_ids in entries:
+            if project_ids is None or employee_ids is None:
+                return None
+            changes["projects"] |= project_ids
+            changes["employees"] |= employee_ids
+            if entry_author is None or entry_author != author:
+                changes["foreign"] += len(project_ids) + len(employee_ids)
+        return changes
+
+    # Function to create the overlays of a new session
+    def open_session(self):
+        base = self.base
+        projects = OverlayList(base.projects, lambda row: self.new_project_id())
+        employees = OverlayList(base.employees, lambda row: row['id'])
+        return projects, employees
@@ -0,0 +1,143 @@
+import random
+
+from load_balancer import LOCAL_SEARCH_SECONDS, balance_workload
+from sites import get_site
+from timeline import DEFAULT_PROCESSING_MINUTES, build_schedule
+
+# Local search time limit when a shard is calculated in the request thread
+INLINE_LOCAL_SEARCH_SECONDS = 0.2
+
+
+# Function to split projects and employees into one shard per site, optionally only for the given sites
+def partition_by_site(projects, employees, sites=None):
+    shards = {}
+    for record_kind, records in (("projects", projects), ("employees", employees)):
+        for record in records:
+            site = get_site(record)
+            if sites is None or site in sites:
+                shards.setdefault(site, {"projects": [], "employees": []})[record_kind].append(record)
+    return dict(sorted(shards.items()))
+
+
+# Function to calculate the station results of a single shard
+def calculate_shard(shard, time_limit=LOCAL_SEARCH_SECONDS):
+    projects = shard["projects"]
+    employees = shard["employees"]
+
+    # Get all unique active stations across all projects
+    all_stations = set()
+    for project in projects:
+        if 'stations' in project:
+            for station, is_active in project['stations'].items():
+                if is_active:
+                    all_stations.add(station)
+
+    # Split each station's workload between its employees
+    balance = balance_workload(projects, employees, time_limit)
+
+    station_results = []
+    for station in sorted(all_stations):
+        # Find employees assigned to this station
+        assigned_employees = []
+        for emp in employees:
+            if 'stations' in emp and station in emp['stations']:
+                assigned_employees.append({
+                    'id': emp['id'],
+                    'processing_time': emp['stations'][station].get('processing_time_minutes', 15)
+                })
+
+        # If no employees are assigned yet, generate a random assignment
+        if not assigned_employees:
+            # Generate random number of employees (1-3)
+            num_mitarbeiter = random.randint(1, 3)
+            assigned_employee_ids = [f"Mitarbeiter {random.randint(1, 5)}" for _ in range(num_mitarbeiter)]
+
+            unassigned_hours = balance["unassigned_quantity"].get(station, 0) * DEFAULT_PROCESSING_MINUTES / 60
+
+            station_results.append({
+                "Station": station,
+                "Mitarbeiter": ", ".join(assigned_employee_ids),
+                "Bearbeitungszeit (Min)": random.randint(5, 30),
+                "Arbeitslast (Std)": round(unassigned_hours, 1),
+                "Verteilung": "Nicht zugewiesen"
+            })
+        else:
+            # Use actual employee assignments
+            employee_ids = [f"Mitarbeiter {emp['id']}" for emp in assigned_employees]
+            avg_processing_time = sum(emp['processing_time'] for emp in assigned_employees) / len(assigned_employees)
+
+            station_minutes = balance["stations"].get(station, {})
+            distribution = [
+                f"Mitarbeiter {emp_id}: {round(minutes / 60, 1)} Std"
+                for emp_id, minutes in sorted(station_minutes.items(), key=lambda item: -item[1])
+            ]
+
+            station_results.append({
+                "Station": station,
+                "Mitarbeiter": ", ".join(employee_ids),
+                "Bearbeitungszeit (Min)": round(avg_processing_time, 1),
+                "Arbeitslast (Std)": round(sum(station_minutes.values()) / 60, 1),
+                "Verteilung": "; ".join(distribution) if distribution else "Keine Arbeit"
+            })
+
+    return {
+        "station_results": station_results,
+        "total_quantity": sum(p["quantity"] for p in projects),
+        "employee_load": balance["employees"],
+        "tasks": build_schedule(projects, employees, balance["assignment"])
+    }
+
+
+# Function to calculate all sites, reusing cached results of unchanged sites
+#
+# fingerprints maps site -> fingerprint (see plan_store.site_fingerprints)
+# and load_shards(sites) returns the shards of the given sites, so the plan
+# is only read when a site is stale. cache maps site -> (fingerprint, result)
+# and is updated in place. Stale shards are calculated in the executor's
+# worker processes when there is more than one of them; a single stale shard
+# is cheaper to calculate inline, with a shorter local search so an edit does
+# not block the page for long.
+def calculate_sites(fingerprints, load_shards, cache, executor=None):
+    stale = [site for site in fingerprints if cache.get(site, (None,))[0] != fingerprints[site]]
+    if stale:
+        loaded = load_shards(stale)
+        # A site whose records were all removed locally has an empty shard
+        shards = [loaded.get(site, {"projects": [], "employees": []}) for site in stale]
+
+        if executor is not None and len(stale) > 1:
+            results = executor.map(calculate_shard, shards)
+        else:
+            results = [calculate_shard(shard, INLINE_LOCAL_SEARCH_SECONDS) for shard in shards]
+        for site, result in zip(stale, results):
+            cache[site] = (fingerprints[site], result)
+
+    # Forget sites that no longer exist
+    for site in list(cache):
+        if site not in fingerprints:
+            del cache[site]
+
+    return {site: cache[site][1] for site in fingerprints}
+
+
+# Function to merge the per-site results into a global summary
+def merge_results(site_results):
+    all_employees = set()
+    processing_times = []
+    for site, result in site_results.items():
+        for station_result in result["station_results"]:
+            processing_times.append(station_result["Bearbeitungszeit (Min)"])
+            for emp in station_result["Mitarbeiter"].split(", "):
+                all_employees.add((site, emp))
+
+    employee_load = [load for result in site_results.values() for load in result["employee_load"]]
+
+    return {
+        "total_sites": len(site_results),
+        "total_stations": len(processing_times),
+        "total_employees": len(all_employees),
+        "total_quantity": sum(result["total_quantity"] for result in site_results.values()),
+        "avg_processing_time": sum(processing_times) / len(processing_times) if processing_times else 0,
+        "total_hours": sum(load["hours"] for load in employee_load),
+        "overloaded_employees": sum(1 for load in employee_load if load["overload_hours"] > 0),
+        "total_overload_hours": sum(load["overload_hours"] for load in employee_load)
+    }
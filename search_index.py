@@ -0,0 +1,140 @@
+import re
+
+# Search index over the projects of a base plan.
+#
+# Names, type prefixes and station bitmasks are kept in lists parallel to the
+# project list so filters without a search text are a single pass over plain
+# ints and strings. Name search uses a trigram index whose postings are lists
+# of positions in ascending order. The index is never changed after it is
+# built: it belongs to one base version and is shared by all sessions on it,
+# which match their own few uncommitted changes on top (see search_changes).
+
+
+# Function to get the project type from the naming scheme "<Typ>-Projekt 1234"
+def project_type(name):
+    return re.split(r"[-\s]", name.strip(), maxsplit=1)[0]
+
+
+# Function to split a name into lowercase trigrams
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+# Function to check a single project against the search filters, like ProjectIndex.search
+def _matches(project, text, type_prefix, stations):
+    name = str(project["name"])
+    active = project.get("stations", {})
+    return (
+        all(active.get(station) for station in stations)
+        and (type_prefix is None or project_type(name) == type_prefix)
+        and (not text or text in name.lower())
+    )
+
+
+class ProjectIndex:
+    def __init__(self, projects=()):
+        self._names = []
+        self._types = []
+        self._masks = []
+        self._trigrams = {}
+        self._type_counts = {}
+        self._station_bits = {}
+        for position, project in enumerate(projects):
+            name = str(project["name"])
+            self._names.append(name.lower())
+            self._types.append(project_type(name))
+            self._masks.append(self._mask(project.get("stations", {})))
+            for trigram in _trigrams(self._names[position]):
+                self._trigrams.setdefault(trigram, []).append(position)
+            type_prefix = self._types[position]
+            self._type_counts[type_prefix] = self._type_counts.get(type_prefix, 0) + 1
+
+    def __len__(self):
+        return len(self._names)
+
+    # Function to convert a stations dict into a bitmask, new stations get the next free bit
+    def _mask(self, stations):
+        mask = 0
+        for station, is_active in stations.items():
+            if is_active:
+                if station not in self._station_bits:
+                    self._station_bits[station] = len(self._station_bits)
+                mask |= 1 << self._station_bits[station]
+        return mask
+
+    # Function to get the number of projects per project type
+    def type_counts(self):
+        return dict(self._type_counts)
+
+    # Function to get all project types with at least one project
+    def types(self):
+        return sorted(self._type_counts)
+
+    # Function to get the positions of all projects matching the filters
+    #
+    # text is matched case-insensitively anywhere in the name, type_prefix
+    # must equal the project type and every station in stations must be active.
+    def search(self, text="", type_prefix=None, stations=()):
+        text = text.strip().lower()
+        required = 0
+        for station in stations:
+            if station not in self._station_bits:
+                # No project is active at this station
+                return []
+            required |= 1 << self._station_bits[station]
+
+        if len(text) >= 3:
+            # Intersect the postings, smallest first
+            postings = sorted((self._trigrams.get(t, []) for t in _trigrams(text)), key=len)
+            candidates = set(postings[0])
+            for posting in postings[1:]:
+                candidates.intersection_update(posting)
+                if not candidates:
+                    return []
+            positions = sorted(candidates)
+        else:
+            positions = range(len(self._names))
+
+        names, types, masks = self._names, self._types, self._masks
+        return [
+            position for position in positions
+            if masks[position] & required == required
+            and (type_prefix is None or types[position] == type_prefix)
+            and (not text or text in names[position])
+        ]
+
+
+# Function to search a list of projects given as an index over its base plus changes
+#
+# index covers the records base_ids, order is the record id order of the
+# list and (modified, added, deleted) its changes against the base, as
+# returned by OverlayList.changes(). Base matches of changed or deleted
+# records are dropped and the changed records are matched one by one, so the
+# cost of the changes only depends on how many there are. Returns positions
+# in order.
+def search_changes(index, base_ids, order, changes, text="", type_prefix=None, stations=()):
+    modified, added, deleted = changes
+    if not modified and not added and not deleted:
+        return index.search(text, type_prefix, stations)
+    matched = {base_ids[position] for position in index.search(text, type_prefix, stations)}
+    matched -= deleted
+    text = text.strip().lower()
+    for record_id, project in list(modified.items()) + list(added.items()):
+        if _matches(project, text, type_prefix, stations):
+            matched.add(record_id)
+        else:
+            matched.discard(record_id)
+    return [position for position, record_id in enumerate(order) if record_id in matched]
+
+
+# Function to get the project types of a list given as an index over its base plus changes
+def types_with_changes(index, base_rows, changes):
+    modified, added, deleted = changes
+    counts = index.type_counts()
+    for record_id in set(modified) | deleted:
+        type_prefix = project_type(str(base_rows.row(record_id)["name"]))
+        counts[type_prefix] -= 1
+    for project in list(modified.values()) + list(added.values()):
+        type_prefix = project_type(str(project["name"]))
+        counts[type_prefix] = counts.get(type_prefix, 0) + 1
+    return sorted(type_prefix for type_prefix, count in counts.items() if count > 0)
@@ -0,0 +1,7 @@
+# Site used for projects and employees that were created before sites existed
+DEFAULT_SITE = "Halle 1"
+
+
+# Function to get the site of a project or employee
+def get_site(record):
+    return record.get("site") or DEFAULT_SITE
@@ -0,0 +1,319 @@
+import contextlib
+import mmap
+import os
+import struct
+import tempfile
+
+from sites import DEFAULT_SITE, get_site
+
+# Binary snapshot of the project list.
+#
+# Layout (little endian):
+#   header    magic, version, project count, section count
+#   directory one (tag, offset, length) entry per section
+#   sections  "QTY " int32 quantity per project
+#             "MASK" uint32 station bitmask per project
+#             "STNS" string table with the station names (bit i = station i)
+#             "NAME" string table with the project names
+#             "SITE" uint16 site number per project
+#             "SNMS" string table with the site names
+#             "IDS " uint32 stable record id per project
+#
+# A string table is an uint32 count, an uint32 offset array with count + 1
+# entries and the UTF-8 encoded strings, so a single name can be decoded
+# without touching the others. Readers look sections up by tag, which lets
+# new sections be added without breaking older files.
+
+SNAPSHOT_MAGIC = b"PLANSNAP"
+SNAPSHOT_VERSION = 1
+MAX_STATIONS = 32
+
+_HEADER = struct.Struct("<8sIII")
+_SECTION = struct.Struct("<4sQQ")
+
+
+# Function to pack a list of strings into a string table
+def _pack_strings(strings):
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = [0]
+    for data in encoded:
+        offsets.append(offsets[-1] + len(data))
+    return struct.pack(f"<{len(offsets) + 1}I", len(encoded), *offsets) + b"".join(encoded)
+
+
+# Function to collect the station names of all projects in first-seen order
+def _collect_stations(projects):
+    stations = []
+    seen = set()
+    for project in projects:
+        for station in project.get("stations", {}):
+            if station not in seen:
+                seen.add(station)
+                stations.append(station)
+    if len(stations) > MAX_STATIONS:
+        raise ValueError(f"Maximal {MAX_STATIONS} Stationen werden unterstützt")
+    return stations
+
+
+# Function to convert a stations dict into a bitmask
+def stations_to_mask(stations, station_bits):
+    mask = 0
+    for station, is_active in stations.items():
+        if is_active:
+            mask |= 1 << station_bits[station]
+    return mask
+
+
+# Function to write projects to a snapshot file, ids default to 1..n
+def write_snapshot(path, projects, ids=None):
+    projects = list(projects)
+    if ids is None:
+        ids = range(1, len(projects) + 1)
+    station_names = _collect_stations(projects)
+    station_bits = {station: bit for bit, station in enumerate(station_names)}
+    site_names = sorted({get_site(p) for p in projects})
+    site_numbers = {site: number for number, site in enumerate(site_names)}
+    count = len(projects)
+
+    sections = [
+        (b"QTY ", struct.pack(f"<{count}i", *(int(p["quantity"]) for p in projects))),
+        (b"MASK", struct.pack(
+            f"<{count}I",
+            *(stations_to_mask(p.get("stations", {}), station_bits) for p in projects)
+        )),
+        (b"STNS", _pack_strings(station_names)),
+        (b"NAME", _pack_strings(str(p["name"]) for p in projects)),
+        (b"SITE", struct.pack(f"<{count}H", *(site_numbers[get_site(p)] for p in projects))),
+        (b"SNMS", _pack_strings(site_names)),
+        (b"IDS ", struct.pack(f"<{count}I", *ids)),
+    ]
+
+    _write_sections(path, count, sections)
+
+
+# Function to write a file through a temporary file that replaces it when done
+#
+# Readers never see a half written file, and the temporary file has a unique
+# name so several processes can write at the same time.
+@contextlib.contextmanager
+def replace_file(path, mode="wb"):
+    directory, name = os.path.split(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f"{name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+# Function to write the header, directory and sections of a snapshot file
+def _write_sections(path, count, sections):
+    with replace_file(path) as f:
+        f.write(_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, count, len(sections)))
+        offset = _HEADER.size + _SECTION.size * len(sections)
+        for tag, data in sections:
+            f.write(_SECTION.pack(tag, offset, len(data)))
+            # Keep every section 4-byte aligned
+            offset += len(data) + (-len(data) % 4)
+        for _, data in sections:
+            f.write(data)
+            f.write(b"\0" * (-len(data) % 4))
+
+
+# Function to write a changed copy of a snapshot without decoding its rows
+#
+# modified maps row position -> new project, deleted is a set of row
+# positions and added a list of (record id, project) appended at the end.
+# All other rows are copied as raw bytes from the old file. Station and site
+# numbers of the old file stay valid, new names get the next free numbers.
+def patch_snapshot(path, snapshot, modified, added, deleted):
+    if snapshot._site is None or snapshot._ids is None:
+        # Files written before sites and ids existed are rewritten once in full
+        ids = snapshot.ids()
+        rows = [modified.get(i) or snapshot[i] for i in range(len(snapshot)) if i not in deleted]
+        kept_ids = [record_id for i, record_id in enumerate(ids) if i not in deleted]
+        write_snapshot(path, rows + [row for _, row in added], kept_ids + [record_id for record_id, _ in added])
+        return
+
+    station_names = list(snapshot.station_names)
+    site_names = list(snapshot.site_names)
+    for project in list(modified.values()) + [row for _, row in added]:
+        for station in project.get("stations", {}):
+            if station not in station_names:
+                station_names.append(station)
+        if get_site(project) not in site_names:
+            site_names.append(get_site(project))
+    if len(station_names) > MAX_STATIONS:
+        raise ValueError(f"Maximal {MAX_STATIONS} Stationen werden unterstützt")
+    station_bits = {station: bit for bit, station in enumerate(station_names)}
+    site_numbers = {site: number for number, site in enumerate(site_names)}
+
+    # Runs of untouched rows as ranges, changed and added rows as (record id, project)
+    pieces = []
+    start = 0
+    for position in sorted(set(modified) | set(deleted)):
+        if position > start:
+            pieces.append(range(start, position))
+        if position not in deleted:
+            record_id = struct.unpack_from("<I", snapshot._buf, snapshot._ids + 4 * position)[0]
+            pieces.append((record_id, modified[position]))
+        start = position + 1
+    if start < len(snapshot):
+        pieces.append(range(start, len(snapshot)))
+    pieces.extend(added)
+    count = sum(len(piece) if isinstance(piece, range) else 1 for piece in pieces)
+
+    buf = snapshot._buf
+
+    def fixed_column(tag, fmt, value):
+        offset = snapshot._sections[tag]
+        width = struct.calcsize(fmt)
+        chunks = []
+        for piece in pieces:
+            if isinstance(piece, range):
+                chunks.append(buf[offset + width * piece.start:offset + width * piece.stop])
+            else:
+                chunks.append(struct.pack(fmt, value(*piece)))
+        return b"".join(chunks)
+
+    # The name offsets of a copied run only move by the length change before it
+    names = snapshot._names
+    name_offsets = [struct.pack("<2I", count, 0)]
+    name_data = []
+    end = 0
+    for piece in pieces:
+        if isinstance(piece, range):
+            run = struct.unpack_from(f"<{len(piece) + 1}I", buf, names._offsets + 4 * piece.start)
+            name_data.append(buf[names._data + run[0]:names._data + run[-1]])
+            shift = end - run[0]
+            if shift:
+                name_offsets.append(struct.pack(f"<{len(piece)}I", *(offset + shift for offset in run[1:])))
+            else:
+                name_offsets.append(buf[names._offsets + 4 * (piece.start + 1):names._offsets + 4 * (piece.stop + 1)])
+            end += run[-1] - run[0]
+        else:
+            data = str(piece[1]["name"]).encode("utf-8")
+            name_data.append(data)
+            end += len(data)
+            name_offsets.append(struct.pack("<I", end))
+
+    sections = [
+        (b"QTY ", fixed_column(b"QTY ", "<i", lambda record_id, p: int(p["quantity"]))),
+        (b"MASK", fixed_column(b"MASK", "<I", lambda record_id, p: stations_to_mask(p.get("stations", {}), station_bits))),
+        (b"STNS", _pack_strings(station_names)),
+        (b"NAME", b"".join(name_offsets) + b"".join(name_data)),
+        (b"SITE", fixed_column(b"SITE", "<H", lambda record_id, p: site_numbers[get_site(p)])),
+        (b"SNMS", _pack_strings(site_names)),
+        (b"IDS ", fixed_column(b"IDS ", "<I", lambda record_id, p: record_id)),
+    ]
+    _write_sections(path, count, sections)
+
+
+# Read-only view on a string table inside the mapped file
+class _StringTable:
+    def __init__(self, buf, offset):
+        self._buf = buf
+        self._count = struct.unpack_from("<I", buf, offset)[0]
+        self._offsets = offset + 4
+        self._data = self._offsets + 4 * (self._count + 1)
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        start, end = struct.unpack_from("<2I", self._buf, self._offsets + 4 * i)
+        return str(self._buf[self._data + start:self._data + end], "utf-8")
+
+
+# Memory-mapped snapshot; rows are decoded only when they are accessed
+class ProjectSnapshot:
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, count, num_sections = _HEADER.unpack_from(self._buf, 0)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} ist keine Projekt-Snapshot-Datei")
+        if version > SNAPSHOT_VERSION:
+            raise ValueError(f"Snapshot-Version {version} wird nicht unterstützt")
+
+        self._count = count
+        self._sections = {}
+        for i in range(num_sections):
+            tag, offset, length = _SECTION.unpack_from(self._buf, _HEADER.size + i * _SECTION.size)
+            self._sections[tag] = offset
+
+        self._qty = self._sections[b"QTY "]
+        self._mask = self._sections[b"MASK"]
+        self._names = _StringTable(self._buf, self._sections[b"NAME"])
+        # The station table is tiny, so decode it once
+        stations = _StringTable(self._buf, self._sections[b"STNS"])
+        self.station_names = [stations[i] for i in range(len(stations))]
+
+        # Snapshots written before sites existed have no site sections
+        self._site = self._sections.get(b"SITE")
+        if self._site is not None:
+            sites = _StringTable(self._buf, self._sections[b"SNMS"])
+            self.site_names = [sites[i] for i in range(len(sites))]
+        else:
+            self.site_names = []
+
+        self._ids = self._sections.get(b"IDS ")
+
+    def __len__(self):
+        return self._count
+
+    def name(self, i):
+        return self._names[i]
+
+    def quantity(self, i):
+        return struct.unpack_from("<i", self._buf, self._qty + 4 * i)[0]
+
+    def station_mask(self, i):
+        return struct.unpack_from("<I", self._buf, self._mask + 4 * i)[0]
+
+    # Function to get the record ids of all rows, snapshots without ids use 1..n
+    def ids(self):
+        if self._ids is None:
+            return list(range(1, self._count + 1))
+        return list(struct.unpack_from(f"<{self._count}I", self._buf, self._ids))
+
+    # Function to get the names of the sites at least one row belongs to
+    def used_sites(self):
+        if self._site is None:
+            return {DEFAULT_SITE} if self._count else set()
+        numbers = set(struct.unpack_from(f"<{self._count}H", self._buf, self._site))
+        return {self.site_names[number] for number in numbers}
+
+    def site(self, i):
+        if self._site is None:
+            return None
+        return self.site_names[struct.unpack_from("<H", self._buf, self._site + 2 * i)[0]]
+
+    # Function to decode a single row into the project dict used by the app
+    def __getitem__(self, i):
+        if not 0 <= i < self._count:
+            raise IndexError(i)
+        mask = self.station_mask(i)
+        project = {
+            "name": self.name(i),
+            "quantity": self.quantity(i),
+            "stations": {
+                station: bool(mask >> bit & 1)
+                for bit, station in enumerate(self.station_names)
+            }
+        }
+        site = self.site(i)
+        if site is not None:
+            project["site"] = site
+        return project
+
+    def __iter__(self):
+        for i in range(self._count):
+            yield self[i]
+
+    def close(self):
+        self._buf.close()
@@ -0,0 +1,46 @@
+from load_balancer import balance_workload
+
+
+def employee(emp_id, minutes, capacity_hours=40):
+    return {
+        "id": emp_id,
+        "capacity_hours": capacity_hours,
+        "stations": {station: {"processing_time_minutes": value} for station, value in minutes.items()}
+    }
+
+
+def project(quantity, *stations):
+    return {"name": f"Projekt {quantity}", "quantity": quantity, "stations": {station: True for station in stations}}
+
+
+def test_greedy_takes_the_processing_time_of_the_employee_into_account():
+    employees = [employee(1, {"Station 1": 30}), employee(2, {"Station 1": 5, "Station 2": 5})]
+    # LPT places the 100-unit job first: both employees are idle, so it must go
+    # to employee 2, who needs 500 minutes for it instead of 3000
+    projects = [project(100, "Station 1"), project(5, "Station 2")]
+
+    result = balance_workload(projects, employees, time_limit=0)
+
+    assert result["assignment"] == {(0, "Station 1"): 2, (1, "Station 2"): 2}
+    assert [round(load["hours"], 2) for load in result["employees"]] == [0, 8.75]
+
+
+def test_loads_are_balanced_relative_to_capacity():
+    employees = [employee(1, {"Station 1": 10}, capacity_hours=20), employee(2, {"Station 1": 10}, capacity_hours=40)]
+    projects = [project(quantity, "Station 1") for quantity in (60, 60, 30, 30, 30, 30)]
+
+    result = balance_workload(projects, employees)
+
+    assert [load["hours"] for load in result["employees"]] == [15, 25]
+    assert max(load["utilization"] for load in result["employees"]) == 0.75
+
+
+def test_stations_without_qualified_employees_stay_unassigned():
+    employees = [employee(1, {"Station 1": 15})]
+    projects = [project(4, "Station 1", "Station 2"), project(6, "Station 2")]
+
+    result = balance_workload(projects, employees)
+
+    assert result["unassigned_quantity"] == {"Station 2": 10}
+    assert result["assignment"] == {(0, "Station 1"): 1}
+    assert result["stations"] == {"Station 1": {1: 60}}
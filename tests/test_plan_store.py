@@ -0,0 +1,357 @@
+import os
+import random
+import threading
+
+import pytest
+
+from plan_store import PlanRegistry
+from snapshot import ProjectSnapshot, patch_snapshot, write_snapshot
+
+
+def make_project(name, quantity=1, site="Halle 1", active=()):
+    return {
+        "name": name,
+        "quantity": quantity,
+        "site": site,
+        "stations": {f"Station {i}": i in active for i in range(1, 4)}
+    }
+
+
+@pytest.fixture
+def registry(tmp_path):
+    registry = PlanRegistry(str(tmp_path / "plan.snap"), str(tmp_path / "employees.json"))
+    registry.replace(
+        [make_project(f"Projekt {i}", quantity=i) for i in range(1, 6)],
+        [{"id": 1, "site": "Halle 1", "stations": {}}]
+    )
+    return registry
+
+
+def names(registry):
+    return [registry.base.projects.row(record_id)["name"] for record_id in registry.base.projects.ids]
+
+
+def test_commits_of_two_sessions_are_merged(registry):
+    projects_a, employees_a = registry.open_session()
+    projects_b, employees_b = registry.open_session()
+
+    projects_a[0]["quantity"] = 10
+    projects_b[1]["quantity"] = 20
+    projects_b.append(make_project("Neu"))
+
+    _, conflicts = registry.commit(projects_a, employees_a, author="a")
+    assert conflicts == {"projects": set(), "employees": set()}
+    _, conflicts = registry.commit(projects_b, employees_b, author="b")
+    assert conflicts == {"projects": set(), "employees": set()}
+
+    base = registry.base
+    assert base.version == 3
+    assert [base.projects.row(record_id)["quantity"] for record_id in base.projects.ids] == [10, 20, 3, 4, 5, 1]
+    assert names(registry)[-1] == "Neu"
+
+
+def test_concurrent_edit_of_the_same_record_is_a_conflict(registry):
+    projects_a, employees_a = registry.open_session()
+    projects_b, employees_b = registry.open_session()
+    record_id = projects_a.ids()[0]
+
+    projects_a[0]["quantity"] = 10
+    projects_b[0]["quantity"] = 20
+    registry.commit(projects_a, employees_a, author="a")
+    _, conflicts = registry.commit(projects_b, employees_b, author="b")
+
+    assert conflicts["projects"] == {record_id}
+    assert registry.base.projects.row(record_id)["quantity"] == 10
+    # The local version is kept for the user to decide
+    assert projects_b.get_by_id(record_id)["quantity"] == 20
+
+
+def test_deleting_a_record_another_session_changed_is_a_conflict(registry):
+    projects_a, employees_a = registry.open_session()
+    projects_b, employees_b = registry.open_session()
+    record_id = projects_a.ids()[1]
+
+    projects_b[1]["quantity"] = 99
+    registry.commit(projects_b, employees_b, author="b")
+    del projects_a[1]
+    projects_a[0]["quantity"] = 10
+    _, conflicts = registry.commit(projects_a, employees_a, author="a")
+
+    assert conflicts["projects"] == {record_id}
+    assert registry.base.projects.row(record_id)["quantity"] == 99
+    assert registry.base.projects.row(projects_a.ids()[0])["quantity"] == 10
+    # The deletion stays local until the user decides
+    conflicts, dropped = projects_a.rebase(registry.base.projects)
+    assert conflicts == {record_id} and not dropped
+    assert projects_a.is_deleted(record_id)
+
+    # Keeping it commits the deletion, the session is on the latest base now
+    _, conflicts = registry.commit(projects_a, employees_a, author="a")
+    assert not conflicts["projects"]
+    assert record_id not in registry.base.projects
+
+
+def test_taking_the_other_change_restores_a_deleted_record(registry):
+    projects_a, employees_a = registry.open_session()
+    projects_b, employees_b = registry.open_session()
+    record_id = projects_a.ids()[1]
+
+    projects_b[1]["quantity"] = 99
+    registry.commit(projects_b, employees_b, author="b")
+    del projects_a[1]
+    projects_a.append(make_project("Neu"))
+    registry.commit(projects_a, employees_a, author="a")
+    projects_a.rebase(registry.base.projects)
+    projects_a.discard(record_id)
+
+    assert projects_a.ids()[1] == record_id
+    assert [project["quantity"] for project in projects_a] == [1, 99, 3, 4, 5, 1]
+    assert not any(projects_a.changes())
+
+
+def test_skipped_records_are_not_committed(registry):
+    projects, employees = registry.open_session()
+    record_id = projects.ids()[0]
+    projects[0]["quantity"] = 10
+    projects[1]["quantity"] = 20
+
+    registry.commit(projects, employees, skip={"projects": {record_id}})
+
+    assert registry.base.projects.row(record_id)["quantity"] == 1
+    assert registry.base.projects.row(projects.ids()[1])["quantity"] == 20
+
+
+def test_rebase_reports_conflicts_and_dropped_records(registry):
+    projects_a, employees_a = registry.open_session()
+    projects_b, employees_b = registry.open_session()
+    first, second, third = projects_a.ids()[:3]
+
+    # a changes the first project and deletes the second
+    projects_a[0]["quantity"] = 10
+    del projects_a[1]
+    registry.commit(projects_a, employees_a, author="a")
+
+    # b edited both of them and the third one, which a did not touch
+    projects_b[0]["quantity"] = 20
+    projects_b[1]["quantity"] = 30
+    projects_b[2]["quantity"] = 40
+    conflicts, dropped = projects_b.rebase(registry.base.projects)
+
+    assert conflicts == {first}
+    assert dropped == {second}
+    assert second not in projects_b.ids()
+    assert projects_b.get_by_id(first)["quantity"] == 20
+    assert projects_b.get_by_id(third)["quantity"] == 40
+    modified, added, deleted = projects_b.changes()
+    assert set(modified) == {first, third}
+    assert not added and not deleted
+
+
+def test_rebase_keeps_local_additions_and_deletions(registry):
+    projects_a, employees_a = registry.open_session()
+    projects_b, employees_b = registry.open_session()
+    deleted_id = projects_b.ids()[4]
+
+    projects_a.append(make_project("Von A"))
+    registry.commit(projects_a, employees_a, author="a")
+
+    del projects_b[4]
+    projects_b.append(make_project("Von B"))
+    projects_b.rebase(registry.base.projects)
+
+    assert [project["name"] for project in projects_b] == ["Projekt 1", "Projekt 2", "Projekt 3", "Projekt 4", "Von A", "Von B"]
+    _, added, deleted = projects_b.changes()
+    assert [row["name"] for row in added.values()] == ["Von B"]
+    assert deleted == {deleted_id}
+
+
+def test_patch_snapshot_matches_a_full_write(tmp_path):
+    rng = random.Random(1)
+    projects = [
+        make_project(f"Projekt {i}" * rng.randint(1, 3), quantity=i, site=rng.choice(["Halle 1", "Halle 2"]), active=(i % 3 + 1,))
+        for i in range(200)
+    ]
+    write_snapshot(str(tmp_path / "old.snap"), projects, range(1, 201))
+    old = ProjectSnapshot(str(tmp_path / "old.snap"))
+
+    modified = {position: make_project(f"Geändert {position}", quantity=7, site="Halle 3", active=(1, 2)) for position in (0, 17, 18, 120)}
+    modified[50] = dict(projects[50], stations={"Station 9": True})
+    deleted = {1, 19, 121, 199}
+    added = [(500, make_project("Neu", quantity=3, site="Halle 4", active=(3,)))]
+    patch_snapshot(str(tmp_path / "new.snap"), old, modified, added, deleted)
+
+    expected_ids = [i + 1 for i in range(200) if i not in deleted] + [500]
+    expected = [modified.get(i, projects[i]) for i in range(200) if i not in deleted] + [added[0][1]]
+    new = ProjectSnapshot(str(tmp_path / "new.snap"))
+    assert new.ids() == expected_ids
+    for row, project in zip(new, expected):
+        active = {station for station, is_active in project["stations"].items() if is_active}
+        assert row["name"] == project["name"]
+        assert row["quantity"] == project["quantity"]
+        assert row["site"] == project["site"]
+        assert {station for station, is_active in row["stations"].items() if is_active} == active
+    assert len(new) == len(expected)
+
+
+def test_second_edit_after_own_commit_is_not_a_conflict(registry):
+    projects, employees = registry.open_session()
+    record_id = projects.ids()[0]
+    # Held across both edits like the project of an open settings dialog
+    project = projects[0]
+
+    project["stations"]["Station 2"] = True
+    base, conflicts = registry.commit(projects, employees, author="a")
+    assert not conflicts["projects"]
+    projects.rebase(base.projects)
+
+    project["quantity"] = 7
+    base, conflicts = registry.commit(projects, employees, author="a")
+
+    assert not conflicts["projects"]
+    assert base.projects.row(record_id)["quantity"] == 7
+    assert base.projects.row(record_id)["stations"]["Station 2"] is True
+
+
+def test_rebase_updates_unchanged_rows_in_place(registry):
+    projects_a, employees_a = registry.open_session()
+    projects_b, employees_b = registry.open_session()
+    project = projects_b[0]
+
+    projects_a[0]["quantity"] = 10
+    registry.commit(projects_a, employees_a, author="a")
+    conflicts, dropped = projects_b.rebase(registry.base.projects)
+
+    assert not conflicts and not dropped
+    assert project["quantity"] == 10
+    assert projects_b[0] is project
+
+
+def test_prune_drops_unchanged_rows_except_the_kept_ones(registry):
+    projects, _ = registry.open_session()
+    held = projects[0]
+    read = [projects[i] for i in range(1, 5)]
+    projects[1]["quantity"] = 10
+    projects.append(make_project("Neu"))
+    new_id = projects.ids()[-1]
+
+    projects.prune(keep={projects.ids()[0]})
+
+    assert set(projects._rows) == {projects.ids()[0], projects.ids()[1], new_id}
+    assert projects[0] is held
+    assert projects[1] is read[0]
+    assert projects[2] is not read[1]
+    assert projects.changes()[0] == {projects.ids()[1]: read[0]}
+
+
+def test_commit_picks_up_files_written_by_another_process(registry):
+    other = PlanRegistry(registry.snapshot_path, registry.employee_path)
+    other_projects, other_employees = other.open_session()
+    other_projects[1]["quantity"] = 20
+    other.commit(other_projects, other_employees)
+
+    projects, employees = registry.open_session()
+    projects[0]["quantity"] = 10
+    # No change feed event arrived before the commit
+    base, conflicts = registry.commit(projects, employees, author="a")
+
+    assert not conflicts["projects"]
+    assert [base.projects.row(record_id)["quantity"] for record_id in base.projects.ids] == [10, 20, 3, 4, 5]
+
+
+def test_commit_flags_records_another_process_changed(registry):
+    projects, employees = registry.open_session()
+    record_id = projects.ids()[0]
+    projects[0]["quantity"] = 10
+
+    other = PlanRegistry(registry.snapshot_path, registry.employee_path)
+    other_projects, other_employees = other.open_session()
+    other_projects[0]["quantity"] = 20
+    other.commit(other_projects, other_employees)
+
+    base, conflicts = registry.commit(projects, employees, author="a")
+
+    assert conflicts["projects"] == {record_id}
+    assert base.projects.row(record_id)["quantity"] == 20
+
+
+def test_changes_since_collects_the_changed_ids(registry):
+    version = registry.base.version
+    projects_a, employees_a = registry.open_session()
+    projects_b, employees_b = registry.open_session()
+    first, second = projects_a.ids()[:2]
+
+    projects_a[0]["quantity"] = 10
+    registry.commit(projects_a, employees_a, author="a")
+    del projects_b[1]
+    employees_b[0]["capacity_hours"] = 20
+    registry.commit(projects_b, employees_b, author="b")
+
+    changes = registry.changes_since(version, author="a")
+    assert changes == {"projects": {first, second}, "employees": {1}, "foreign": 2}
+    assert registry.changes_since(version, author="b")["foreign"] == 1
+    assert registry.changes_since(registry.base.version) == {"projects": set(), "employees": set(), "foreign": 0}
+
+
+def test_changes_since_needs_a_complete_journal(registry, monkeypatch):
+    # replace() changes every record
+    assert registry.changes_since(registry.base.version - 1) is None
+
+    monkeypatch.setattr("plan_store.JOURNAL_LENGTH", 2)
+    version = registry.base.version
+    projects, employees = registry.open_session()
+    for quantity in (10, 11, 12):
+        projects[0]["quantity"] = quantity
+        base, _ = registry.commit(projects, employees)
+        projects.rebase(base.projects)
+
+    assert registry.changes_since(version) is None
+    assert registry.changes_since(version + 1) is not None
+
+
+def test_reload_if_changed_journals_the_external_changes(registry):
+    version = registry.base.version
+    other = PlanRegistry(registry.snapshot_path, registry.employee_path)
+    other_projects, other_employees = other.open_session()
+    record_id = other_projects.ids()[2]
+    other_projects[2]["name"] = "Umbenannt"
+    other.commit(other_projects, other_employees)
+
+    assert registry.reload_if_changed()
+    assert not registry.reload_if_changed()
+    assert registry.changes_since(version) == {"projects": {record_id}, "employees": set(), "foreign": 1}
+
+
+def test_two_registries_on_the_same_files_commit_concurrently(registry):
+    # A second registry stands in for another server process
+    other = PlanRegistry(registry.snapshot_path, registry.employee_path)
+    errors = []
+
+    def edit(registry, position, name):
+        try:
+            for i in range(20):
+                registry.reload_if_changed()
+                projects, employees = registry.open_session()
+                projects[position]["quantity"] += 1
+                projects.append(make_project(f"{name} {i}"))
+                _, conflicts = registry.commit(projects, employees, author=name)
+                assert not conflicts["projects"]
+        except Exception as error:
+            errors.append(error)
+
+    threads = [
+        threading.Thread(target=edit, args=(registry, 0, "a")),
+        threading.Thread(target=edit, args=(other, 1, "b")),
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    registry.reload_if_changed()
+    rows = [registry.base.projects.row(record_id) for record_id in registry.base.projects.ids]
+    assert [row["quantity"] for row in rows[:2]] == [21, 22]
+    assert sorted(row["name"] for row in rows[5:]) == sorted([f"a {i}" for i in range(20)] + [f"b {i}" for i in range(20)])
+    assert len(set(registry.base.projects.ids)) == len(rows)
+    # No temporary files are left behind
+    assert sorted(os.listdir(os.path.dirname(registry.snapshot_path))) == ["employees.json", "plan.snap", "plan.snap.lock"]
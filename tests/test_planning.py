@@ -0,0 +1,100 @@
+import planning
+from plan_store import PlanRegistry, site_fingerprints
+from planning import calculate_sites, partition_by_site
+
+
+def make_project(name, quantity=1, site="Halle 1"):
+    return {"name": name, "quantity": quantity, "site": site, "stations": {"Station 1": True}}
+
+
+def make_registry(tmp_path):
+    registry = PlanRegistry(str(tmp_path / "plan.snap"), str(tmp_path / "employees.json"))
+    registry.replace(
+        [make_project(f"Projekt {i}", quantity=i, site=f"Halle {i % 3 + 1}") for i in range(1, 10)],
+        [{"id": 1, "site": "Halle 1", "stations": {"Station 1": {"processing_time_minutes": 10}}}]
+    )
+    return registry
+
+
+# Counts the shards calculate_sites hands to calculate_shard
+def count_calculations(monkeypatch):
+    calculated = []
+
+    def calculate_shard(shard, time_limit=None):
+        calculated.append(shard)
+        return {"station_results": [], "total_quantity": sum(p["quantity"] for p in shard["projects"])}
+
+    monkeypatch.setattr(planning, "calculate_shard", calculate_shard)
+    return calculated
+
+
+def calculate(projects, employees, cache):
+    return calculate_sites(
+        site_fingerprints(projects, employees),
+        lambda sites: partition_by_site(projects, employees, sites),
+        cache
+    )
+
+
+def test_editing_one_site_recalculates_only_that_shard(tmp_path, monkeypatch):
+    calculated = count_calculations(monkeypatch)
+    registry = make_registry(tmp_path)
+    projects, employees = registry.open_session()
+    cache = {}
+
+    results = calculate(projects, employees, cache)
+    assert list(results) == ["Halle 1", "Halle 2", "Halle 3"]
+    assert len(calculated) == 3
+
+    # Nothing changed, nothing is calculated
+    calculated.clear()
+    calculate(projects, employees, cache)
+    assert calculated == []
+
+    projects[0]["quantity"] = 100
+    site = projects[0]["site"]
+    results = calculate(projects, employees, cache)
+    assert [shard["projects"][0]["site"] for shard in calculated] == [site]
+    assert results[site]["total_quantity"] == sum(p["quantity"] for p in projects if p["site"] == site)
+
+
+def test_moving_a_project_recalculates_both_sites(tmp_path, monkeypatch):
+    calculated = count_calculations(monkeypatch)
+    registry = make_registry(tmp_path)
+    projects, employees = registry.open_session()
+    cache = {}
+    calculate(projects, employees, cache)
+
+    calculated.clear()
+    old_site = projects[0]["site"]
+    projects[0]["site"] = "Halle 4"
+    results = calculate(projects, employees, cache)
+    assert sorted({project["site"] for shard in calculated for project in shard["projects"]}) == sorted([old_site, "Halle 4"])
+    assert "Halle 4" in results
+
+
+def test_commit_only_changes_the_fingerprints_of_changed_sites(tmp_path):
+    registry = make_registry(tmp_path)
+    projects_a, employees_a = registry.open_session()
+    projects_b, employees_b = registry.open_session()
+    before = site_fingerprints(projects_b, employees_b)
+
+    projects_a[0]["quantity"] = 100
+    site = projects_a[0]["site"]
+    registry.commit(projects_a, employees_a)
+    projects_b.rebase(registry.base.projects)
+    employees_b.rebase(registry.base.employees)
+    after = site_fingerprints(projects_b, employees_b)
+
+    assert [name for name in after if after[name] != before[name]] == [site]
+
+
+def test_site_without_records_is_calculated_empty_and_forgotten(monkeypatch):
+    calculated = count_calculations(monkeypatch)
+    cache = {"Halle 9": ("alt", {})}
+
+    results = calculate_sites({"Halle 1": "neu"}, lambda sites: {}, cache)
+
+    assert calculated == [{"projects": [], "employees": []}]
+    assert results == {"Halle 1": {"station_results": [], "total_quantity": 0}}
+    assert list(cache) == ["Halle 1"]
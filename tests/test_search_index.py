@@ -0,0 +1,97 @@
+from plan_store import PlanRegistry, project_types, search_projects
+from search_index import ProjectIndex
+
+
+def make_project(name, active=()):
+    return {
+        "name": name,
+        "quantity": 1,
+        "stations": {f"Station {i}": i in active for i in range(1, 4)}
+    }
+
+
+def session(tmp_path, projects):
+    registry = PlanRegistry(str(tmp_path / "plan.snap"), str(tmp_path / "employees.json"))
+    registry.replace(projects, [])
+    return registry
+
+
+def assert_matches_rebuild(projects):
+    rebuilt = ProjectIndex(projects)
+    assert project_types(projects) == rebuilt.types()
+    for text, type_prefix, stations in (
+        ("", None, ()),
+        ("projekt", None, ()),
+        ("web", None, ()),
+        ("", "Cloud", ()),
+        ("", None, ("Station 2",)),
+        ("pro", "Web", ("Station 1",)),
+    ):
+        assert search_projects(projects, text, type_prefix, stations) == rebuilt.search(text, type_prefix, stations)
+
+
+def test_search_filters():
+    index = ProjectIndex([
+        make_project("Web-Projekt 1000", active=(1,)),
+        make_project("Cloud-Projekt 2000", active=(1, 2)),
+        make_project("Web-Projekt 3000", active=(2,)),
+    ])
+
+    assert index.types() == ["Cloud", "Web"]
+    assert index.search("projekt") == [0, 1, 2]
+    assert index.search("WEB-pro") == [0, 2]
+    assert index.search("", type_prefix="Cloud") == [1]
+    assert index.search("", stations=["Station 2"]) == [1, 2]
+    assert index.search("", stations=["Station 9"]) == []
+
+
+def test_sessions_share_the_index_of_their_base(tmp_path):
+    registry = session(tmp_path, [make_project(f"Web-Projekt {i}") for i in range(1000, 1005)])
+    projects_a, _ = registry.open_session()
+    projects_b, _ = registry.open_session()
+
+    assert project_types(projects_a) == []
+    assert search_projects(projects_a, "1003") == [3]
+    assert project_types(projects_b) == ["Web"]
+    assert registry.base.projects.search_index() is projects_b._base.search_index()
+
+
+def test_local_changes_are_matched_on_top_of_the_shared_index(tmp_path):
+    registry = session(tmp_path, [
+        make_project("Web-Projekt 1000", active=(1,)),
+        make_project("Cloud-Projekt 2000", active=(1, 2)),
+        make_project("Web-Projekt 3000", active=(2,)),
+        make_project("KI-Projekt 4000"),
+    ])
+    projects, _ = registry.open_session()
+    index = registry.base.projects.search_index()
+
+    del projects[1]
+    projects[1]["name"] = "Cloud-Projekt 3000"
+    projects[1]["stations"]["Station 1"] = True
+    projects.append(make_project("Web-Projekt 5000", active=(3,)))
+
+    assert [project["name"] for project in projects] == ["Web-Projekt 1000", "Cloud-Projekt 3000", "KI-Projekt 4000", "Web-Projekt 5000"]
+    assert search_projects(projects, "cloud") == [1]
+    assert search_projects(projects, "", stations=["Station 1"]) == [0, 1]
+    assert search_projects(projects, "5000") == [3]
+    assert search_projects(projects, "", stations=["Station 3"]) == [3]
+    assert_matches_rebuild(projects)
+    # The shared index is left as it was
+    assert index.search("cloud") == [1]
+
+
+def test_search_after_another_session_committed(tmp_path):
+    registry = session(tmp_path, [make_project(f"Web-Projekt {i}") for i in range(1000, 1005)])
+    projects, _ = registry.open_session()
+    projects.append(make_project("Cloud-Projekt 9000"))
+    assert search_projects(projects, "cloud") == [5]
+
+    other_projects, other_employees = registry.open_session()
+    del other_projects[0]
+    other_projects[0]["name"] = "KI-Projekt 1001"
+    registry.commit(other_projects, other_employees)
+    projects.rebase(registry.base.projects)
+
+    assert search_projects(projects, "cloud") == [4]
+    assert_matches_rebuild(projects)
@@ -0,0 +1,80 @@
+from timeline import UNASSIGNED, aggregate_timeline, build_schedule
+
+
+def test_more_lanes_than_points_keeps_the_busiest_lanes():
+    # Lane i is busy for i minutes
+    tasks = [(f"Lane {i}", "Aufgabe", 0, i) for i in range(1, 11)]
+
+    timeline = aggregate_timeline(tasks, 0, 100, max_points=4)
+
+    assert timeline["hidden_lanes"] == 6
+    assert {bar["lane"] for bar in timeline["bars"]} == {"Lane 7", "Lane 8", "Lane 9", "Lane 10"}
+    assert timeline["total_tasks"] == 4
+    assert not timeline["aggregated"]
+
+
+def test_more_tasks_than_points_are_bucketed():
+    tasks = [(f"Lane {i % 3}", "Aufgabe", minute, minute + 1) for i, minute in enumerate(range(0, 1000, 2))]
+
+    timeline = aggregate_timeline(tasks, 0, 1000, max_points=30)
+
+    assert timeline["aggregated"]
+    assert len(timeline["bars"]) <= 30
+    assert timeline["total_tasks"] == len(tasks)
+    assert timeline["hidden_lanes"] == 0
+    # Every task is counted once and its busy time is kept
+    assert sum(bar["count"] for bar in timeline["bars"]) == len(tasks)
+    assert sum(bar["busy"] for bar in timeline["bars"]) == len(tasks)
+
+
+def test_tasks_are_cut_at_the_window_edges():
+    tasks = [
+        ("A", "vorher", 0, 10),
+        ("A", "über den Anfang", 5, 15),
+        ("A", "innen", 20, 30),
+        ("A", "über das Ende", 45, 60),
+        ("A", "nachher", 50, 70),
+    ]
+
+    timeline = aggregate_timeline(tasks, 10, 50)
+    assert [bar["label"] for bar in timeline["bars"]] == ["über den Anfang", "innen", "über das Ende"]
+
+    # Bucketed bars only count the busy time inside the window
+    timeline = aggregate_timeline(tasks, 10, 50, max_points=2)
+    assert timeline["aggregated"]
+    assert timeline["total_tasks"] == 3
+    assert sum(bar["busy"] for bar in timeline["bars"]) == 5 + 10 + 5
+    assert all(10 <= bar["start"] and bar["end"] <= 50 for bar in timeline["bars"])
+
+
+def test_build_schedule_picks_the_employee_who_finishes_first():
+    projects = [
+        {"name": "P1", "quantity": 2, "stations": {"Station 1": True, "Station 2": True}},
+        {"name": "P2", "quantity": 1, "stations": {"Station 1": True, "Station 2": False}},
+    ]
+    employees = [
+        {"id": 1, "stations": {"Station 1": {"processing_time_minutes": 10}}},
+        {"id": 2, "stations": {"Station 1": {"processing_time_minutes": 25}}},
+    ]
+
+    tasks = build_schedule(projects, employees)
+
+    assert tasks == [
+        ("Station 1", "Mitarbeiter 1", "P1", 0, 20),
+        # Station 2 has no employee, so the default processing time is used
+        ("Station 2", UNASSIGNED, "P1", 20, 50),
+        # Employee 1 is busy until minute 20 and would finish at 30, employee 2 finishes at 25
+        ("Station 1", "Mitarbeiter 2", "P2", 0, 25),
+    ]
+
+
+def test_build_schedule_follows_the_assignment():
+    projects = [{"name": "P1", "quantity": 2, "stations": {"Station 1": True}}]
+    employees = [
+        {"id": 1, "stations": {"Station 1": {"processing_time_minutes": 10}}},
+        {"id": 2, "stations": {"Station 1": {"processing_time_minutes": 30}}},
+    ]
+
+    tasks = build_schedule(projects, employees, {(0, "Station 1"): 2})
+
+    assert tasks == [("Station 1", "Mitarbeiter 2", "P1", 0, 60)]
@@ -0,0 +1,118 @@
+import heapq
+
+# Maximum number of bars sent to the browser for one timeline chart
+MAX_TIMELINE_POINTS = 2000
+
+# Processing time used for stations without a configured employee
+DEFAULT_PROCESSING_MINUTES = 15
+
+UNASSIGNED = "Nicht zugewiesen"
+
+
+# Function to build the schedule of one site
+#
+# Every project runs through its active stations in station order. At each
+# station the task goes to the configured employee who can finish it first,
+# taking into account that an employee works on one task at a time even if
+# they are configured for several stations. If assignment maps
+# (project position, station) to an employee id, e.g. from the load
+# balancer, that employee does the task. Returns a list of
+# (station, employee, project name, start minute, end minute) tuples.
+def build_schedule(projects, employees, assignment=None):
+    station_employees = {}
+    employee_minutes = {}
+    for emp in employees:
+        for station, settings in emp.get('stations', {}).items():
+            minutes = settings.get('processing_time_minutes', DEFAULT_PROCESSING_MINUTES)
+            station_employees.setdefault(station, []).append((f"Mitarbeiter {emp['id']}", minutes))
+            employee_minutes[(emp['id'], station)] = minutes
+
+    employee_free = {}
+    tasks = []
+    for position, project in enumerate(projects):
+        ready = 0
+        active_stations = sorted(station for station, is_active in project.get('stations', {}).items() if is_active)
+        for station in active_stations:
+            emp_id = assignment.get((position, station)) if assignment else None
+            if emp_id is not None:
+                candidates = [(f"Mitarbeiter {emp_id}", employee_minutes[(emp_id, station)])]
+            else:
+                candidates = station_employees.get(station) or [(UNASSIGNED, DEFAULT_PROCESSING_MINUTES)]
+            best = None
+            for employee, minutes in candidates:
+                # Without a configured employee the station works on one task at a time
+                free = employee_free.get((station, employee), 0) if employee == UNASSIGNED else employee_free.get(employee, 0)
+                start = max(ready, free)
+                end = start + project["quantity"] * minutes
+                if best is None or end < best[2]:
+                    best = (employee, start, end)
+            employee, start, end = best
+            employee_free[(station, employee) if employee == UNASSIGNED else employee] = end
+            tasks.append((station, employee, project["name"], start, end))
+            ready = end
+    return tasks
+
+
+# Function to reduce a schedule to at most max_points bars for the given time window
+#
+# tasks are (lane, label, start, end) tuples. When the window holds few
+# enough tasks they are returned unchanged; otherwise every lane is split
+# into equally wide time buckets and each bucket reports how many tasks
+# touch it and how busy the lane was. If there are more lanes than points
+# only the busiest lanes are kept.
+def aggregate_timeline(tasks, window_start, window_end, max_points=MAX_TIMELINE_POINTS):
+    visible = [task for task in tasks if task[2] < window_end and task[3] > window_start]
+    lanes = {}
+    for lane, _, start, end in visible:
+        lanes[lane] = lanes.get(lane, 0) + min(end, window_end) - max(start, window_start)
+
+    hidden_lanes = 0
+    if len(lanes) > max_points:
+        kept = set(heapq.nlargest(max_points, lanes, key=lanes.get))
+        hidden_lanes = len(lanes) - len(kept)
+        visible = [task for task in visible if task[0] in kept]
+        lanes = {lane: busy for lane, busy in lanes.items() if lane in kept}
+
+    if len(visible) <= max_points:
+        return {
+            "aggregated": False,
+            "bars": [
+                {"lane": lane, "start": start, "end": end, "label": label, "count": 1, "busy": end - start}
+                for lane, label, start, end in visible
+            ],
+            "total_tasks": len(visible),
+            "hidden_lanes": hidden_lanes
+        }
+
+    num_buckets = max(1, max_points // len(lanes))
+    width = (window_end - window_start) / num_buckets
+    buckets = {}
+    for lane, _, start, end in visible:
+        start = max(start, window_start)
+        end = min(end, window_end)
+        first = int((start - window_start) // width)
+        last = min(int((end - window_start) // width), num_buckets - 1)
+        for bucket in range(first, last + 1):
+            bucket_start = window_start + bucket * width
+            overlap = min(end, bucket_start + width) - max(start, bucket_start)
+            if overlap <= 0 and bucket != first:
+                continue
+            count, busy = buckets.get((lane, bucket), (0, 0))
+            buckets[(lane, bucket)] = (count + 1, busy + max(overlap, 0))
+
+    return {
+        "aggregated": True,
+        "bars": [
+            {
+                "lane": lane,
+                "start": window_start + bucket * width,
+                "end": window_start + (bucket + 1) * width,
+                "label": f"{count} Aufgaben",
+                "count": count,
+                "busy": busy
+            }
+            for (lane, bucket), (count, busy) in sorted(buckets.items())
+        ],
+        "total_tasks": len(visible),
+        "hidden_lanes": hidden_lanes
+    }